@@ -1,23 +1,43 @@
 # USAGE:
+# Launch from the Script Editor (Python tab): import lx_modelCompare; lx_modelCompare.run()
 # Enter alembic paths into fields to check model changes
 # First you must click Load Meshes to load in the models and log their data
+# Models are only referenced into the scene once a command needs the live meshes (Blend All, Copy Shaders, topology details)
 # Then you can run Compare Meshes to spit out information in the Maya console.
 # Look in script editor for details
-# You must be properly set in a maya project
+# Mesh snapshots are cached per alembic file (see SnapshotCache in lx_modelCompareCore), so reloading a file is free
+#
+# BATCH:
+# mayapy lx_modelCompare.py old.abc new.abc -o report.json
+# Writes a JSON (or .csv) diff report. Exit code 0 = no changes, 1 = changes found, 2 = error
+# mayapy lx_modelCompare.py --history v001.abc v002.abc v003.abc ... -o history.csv
+# Change timeline per mesh over all versions (.abc or .lxmc snapshots), printed as a change matrix by default
+# Uncached files are snapshotted by parallel mayapy workers (mayapy lx_modelCompare.py --extract <abc> <snapshot>)
 
 import maya.cmds as mc
-import maya.OpenMaya as om
-import pymel.core as pm
+import maya.api.OpenMaya as om2
+import numpy as np
 
 import os
 import os.path
 import re
+import sys
+import time
+import shutil
+import argparse
+import collections
+import contextlib
 
 import functools
 from functools import partial
 
 from datetime import datetime
 
+import lx_modelCompareCore as mcc
+
+
+# Snapshots are shared between scenes and sessions, keyed on the alembic file itself
+snapshotCache = mcc.SnapshotCache()
 
 
 
@@ -61,7 +81,14 @@ def createUI(pWindowTitle):
     mc.separator( h=20, style='none')
     mc.button(label='Load Meshes', bgc=(0.5,0.55,0.8), ebg=1, command = partial(loadMeshes, fa, fb) )
     mc.separator( h=10, style='none')
-    mc.button(label='Compare Meshes', bgc=(0.5,0.8,0.6), ebg=1, command = partial(compareMeshes, fa, fb) )
+    mc.rowColumnLayout(numberOfColumns=4, columnWidth=[(1,150),(2,150),(3,150),(4,150)])
+    mc.text(label="Vertex tolerance:", al='left')
+    vTol = mc.floatField(v=mcc.DEFAULT_THRESHOLDS.vertex, pre=6, min=0)
+    mc.text(label="BBox tolerance:", al='left')
+    bTol = mc.floatField(v=mcc.DEFAULT_THRESHOLDS.bbox, pre=6, min=0)
+    mc.setParent("..")
+    mc.separator( h=5, style='none')
+    mc.button(label='Compare Meshes', bgc=(0.5,0.8,0.6), ebg=1, command = partial(compareMeshes, fa, fb, vTol, bTol) )
     mc.separator( h=30, style='none')
     autoShader = mc.checkBox(l='Assign shader to blendshaped objects', v=0)
     autoSet = mc.checkBox(l='Add blendshaped objects to a Maya set', v=0)
@@ -87,44 +114,121 @@ def label_style (value, style):
 ### ############### ###
 
 
+# Read one mesh shape into a snapshot record and its world points with a single pass over its API data
+def getMeshRecord(shape):
+    sel = om2.MSelectionList()
+    sel.add(shape)
+    path = sel.getDagPath(0)
+    mesh = om2.MFnMesh(path)
+
+    counts, connects = mesh.getVertices()
+    points = getWorldPoints(mesh)
+    
+    record = mcc.MeshRecord(
+        name = mcc.stripNamespace(path.partialPathName()).split('|')[-1],
+        path = mcc.stripNamespace(path.fullPathName()),
+        vertices = mesh.numVertices,
+        edges = mesh.numEdges,
+        faces = mesh.numPolygons,
+        topology = mcc.getTopologyHash(counts, connects),
+        points = mcc.getPointsHash(points),
+        bbox = mcc.getBBox(points),
+        uvSets = list(mesh.getUVSetNames()),
+    )
+    return record, points
+
+
+
+# World space points of a mesh in the scene as an (N, 3) array
+def getPointArray(shape):
+    sel = om2.MSelectionList()
+    sel.add(shape)
+    return getWorldPoints(om2.MFnMesh(sel.getDagPath(0)))
+
+
+
+# World space points from one getPoints call on an MFnMesh, as an (N, 3) array
+def getWorldPoints(mesh):
+    return np.array(mesh.getPoints(om2.MSpace.kWorld), dtype=np.float64).reshape(-1, 4)[:, :3]
+
+
+
 # Mesh Class for storing and writing mesh information
-# 1. store: Reads and stores mesh data to disk
-# 2. reference: create maya reference of filepath
-# 3. dataFolder: makes data folder if necessary within project set
-# 4. meshInfo: Retrieve previously stored mesh information and return it
+# 1. store: Reads mesh data and points and writes them to a binary snapshot on disk (or to path), only from our own reference
+# 2. reference/unload/referenceFile/isLoaded/ensureLoaded: (re)place or remove the maya reference of filepath in our namespace / check it's the one loaded / reference it only if it isn't
+# 3. dataFolder: makes data folder if necessary within project set (only used without a snapshot cache)
+# 4. snapshotPath/snapshot/isCached: Location of the stored snapshot / memory mapped view of it / whether it exists
+# 5. meshInfo: Retrieve previously stored mesh information and return it
 class Mesh(object):
-    def __init__(self, nspace, path):
+    def __init__(self, nspace, path, cache=None):
         self.nspace = nspace
+        self.cache = cache
         _p = path
         _p = _p.replace(os.sep, '/')
         _p = _p.replace('"', '')
         self.path = _p
         
-    def store(self):
-        mc.select(self.nspace+":*")
-        meshList = mc.ls(sl=True, type='mesh')
-        storeLoc = self.dataFolder()
-
-        s = " :: "
-        with open(storeLoc + "/" + self.nspace + "_modelData" + ".txt", 'wt') as disk_file:
-            disk_file.write("_FILENAME_" +s+ self.path+"\n")
-            for _ in meshList:
-                # print("debug "+_+"\n")
-                m = _.split(":")
-                
-                sel = om.MSelectionList()
-                sel.add(_)
-                path = om.MDagPath()
-                sel.getDagPath(0, path)
-                mesh = om.MFnMesh(path)
-                poly = mesh.numPolygons() # polycount
-
-                
-                disk_file.write("_MESHNAME_" + s+ m[1]+ s+ str(poly)+"\n")
+    def store(self, path=None):
+        # Never snapshot whatever else sits in our namespace under this file's cache key
+        if not self.isLoaded():
+            raise RuntimeError("{} is not the file referenced in namespace {}".format(self.path, self.nspace))
+        meshList = mc.ls(self.nspace + ":*", type='mesh', long=True, noIntermediate=True)
+        data = [getMeshRecord(m) for m in meshList]
+        records = [r for r, p in data]
+        points = [p for r, p in data]
+        if path:
+            mcc.writeSnapshot(path, os.path.abspath(self.path), records, points)
+        elif self.cache:
+            self.cache.put(self.path, records, points)
+        else:
+            mcc.writeSnapshot(self.snapshotPath(), self.path, records, points)
    
    
+    # Replaces whatever is referenced in our namespace, Maya would otherwise silently pick another one (fileA1)
     def reference(self):
-        mc.file(self.path, r=True, ns=self.nspace)
+        ref = self.referenceFile()
+        if ref:
+            mc.file(ref, removeReference=True)
+        if mc.namespace(exists=self.nspace):
+            # Left empty by the removed reference, anything still in it isn't ours to snapshot
+            if mc.namespaceInfo(self.nspace, listNamespace=True):
+                raise RuntimeError("Namespace {} holds nodes that don't come from a reference".format(self.nspace))
+            mc.namespace(removeNamespace=self.nspace)
+        ref = mc.file(self.path, r=True, ns=self.nspace)
+        nspace = mc.file(ref, q=True, namespace=True)
+        if nspace != self.nspace:
+            raise RuntimeError("{} was referenced in namespace {} instead of {}".format(self.path, nspace, self.nspace))
+        
+        
+    def unload(self):
+        ref = self.referenceFile()
+        if ref:
+            mc.file(ref, removeReference=True)
+        
+        
+    # For commands that need the live meshes, snapshots alone never reference anything
+    def ensureLoaded(self):
+        if not self.isLoaded():
+            initStandalone()
+            self.reference()
+        
+        
+    # Reference file loaded in our namespace, whatever its path
+    def referenceFile(self):
+        if not isMayaRunning() or not mc.namespace(exists=self.nspace):
+            return None
+        for ref in mc.file(q=True, reference=True) or []:
+            if mc.file(ref, q=True, namespace=True) == self.nspace:
+                return ref
+        return None
+        
+        
+    def isLoaded(self):
+        ref = self.referenceFile()
+        if not ref:
+            return False
+        refPath = mc.referenceQuery(ref, filename=True, withoutCopyNumber=True)
+        return os.path.normcase(os.path.abspath(refPath)) == os.path.normcase(os.path.abspath(self.path))
                 
             
     def dataFolder(self):
@@ -150,126 +254,128 @@ class Mesh(object):
         return storePath
         
         
-    def meshInfo(self):
-        storeLoc = self.dataFolder()
-        # dataFiles = [f for f in os.listdir(storeLoc) if os.path.isdir(storeLoc)] DEBUG
-        data = storeLoc + "/" + self.nspace + "_modelData.txt"
+    def snapshotPath(self):
+        if self.cache:
+            return self.cache.getPath(self.path)
+        return self.dataFolder() + "/" + self.nspace + "_modelData" + mcc.SNAPSHOT_EXT
         
-        with open(data, 'r') as f:
-            dataList = [line.strip() for line in f] # every line into a list
-            
-        fName = dataList[0] 
-        fName.replace("_FILENAME_ :: ","")
-        dataList.pop(0)
         
-        meshCount = len(dataList)
-            
-        mList = []
-          
-        for l in dataList:
-            sub = l.split(" :: ")
-            sub.pop(0)
-            mList.append(sub)
+    def snapshot(self):
+        return mcc.Snapshot(self.snapshotPath())
+        
         
-        return [fName, meshCount, mList]
+    def isCached(self):
+        if self.cache:
+            return self.cache.contains(self.path)
+        return os.path.isfile(self.snapshotPath())
+        
+        
+    def meshInfo(self):
+        with self.snapshot() as snap:
+            mList = [[m.name, m.faces] for m in snap]
+            fName = snap.source
+        
+        return [fName, len(mList), mList]
 
 
 
 
 # Supervisor class for parsing and comparing mesh information
+# Meshes are paired once up front by mcc.matchMeshes: by shape name, then by the fallback key for leftovers,
+# then (spatial) by topology fingerprint plus bbox position and size so renamed meshes still get compared
 # 1. meshCountCompare: Compare mesh count
-# 2. nameCompare: Compare mesh names (Currently just shape nodes)
-# 3. compList: Return pruned comparative lists of matching size, removing non-shared elements
-# 4. polyCompare: Compare poly count changes between meshes named the same between versions
+# 2. nameCompare/renameCompare: Compare mesh names (Currently just shape nodes) / meshes matched under a new name
+# 3. compList: Return aligned lists of matched meshes, removing non-shared elements
+# 4. topologyCompare/polyCompare: Topology changes between matched meshes, only pairs with different topology fingerprints hit Maya
+# 5. pointCompare: Per-vertex displacement between matched meshes with the same vertex count, from the snapshots when they hold points
+# 6. report: Everything above as a machine readable report dict
+# With live, topology changes reference both models to explain them, otherwise only already referenced models are used
 class Supervisor(object):
-    def __init__(self, meshA, meshB, *args):
+    def __init__(self, meshA, meshB, fallback='path', spatial=True, live=False, *args):
         self.meshA = meshA
         self.meshB = meshB
+        self.live = live
         
-        self.mListA = self.meshA.meshInfo()
-        self.mListB = self.meshB.meshInfo()
+        self.snapA = self.meshA.snapshot()
+        self.snapB = self.meshB.snapshot()
         
-        self.dListA = sorted(self.mListA[2])
-        self.dListB = sorted(self.mListB[2])
+        self.match = mcc.matchMeshes(self.snapA, self.snapB, fallback, spatial)
 
 
     def meshCountCompare(self):
-        a = self.mListA[1]
-        b = self.mListB[1]
+        a = len(self.snapA)
+        b = len(self.snapB)
         diff = a - b
         return [diff,a,b]
         
         
     def nameCompare(self):
-        meshListA = []
-        meshListB = []
-
-        for m in self.dListA:
-            meshListA.append(m[0])
-        for m in self.dListB:
-            meshListB.append(m[0])
-        
-        misListA = []
-        misListB = []
-        for m in meshListA:
-            if m not in meshListB:
-                misListA.append(m)
-                for x in self.dListA:
-                    if m == x[0]:
-                        self.dListA.remove(x)
-        for m in meshListB:
-            if m not in meshListA:
-                misListB.append(m)
-                for x in self.dListB:
-                    if m == x[0]:
-                        self.dListB.remove(x)
-        
+        misListA = [m.name for m in self.match.aOnly]
+        misListB = [m.name for m in self.match.bOnly]
         return [misListA,misListB]
         
         
+    def renameCompare(self):
+        return [[a.name, b.name] for a, b in self.match.renamed]
+        
+        
     def compList(self):
-        meshListA = []
-        meshListB = []
-
-        for m in self.dListA:
-            meshListA.append(m[0])
-        for m in self.dListB:
-            meshListB.append(m[0])
-        
-        misListA = []
-        misListB = []
-        for m in meshListA:
-            if m not in meshListB:
-                misListA.append(m)
-                for x in self.dListA:
-                    if m == x[0]:
-                        self.dListA.remove(x)
-        for m in meshListB:
-            if m not in meshListA:
-                misListB.append(m)
-                for x in self.dListB:
-                    if m == x[0]:
-                        self.dListB.remove(x)
-        
-        return [self.dListA,self.dListB]
+        dListA = [a for a, b in self.match.pairs]
+        dListB = [b for a, b in self.match.pairs]
+        return [dListA,dListB]
         
     
-    def polyCompare(self):
+    def topologyCompare(self):
         misList = []
-        for c, m in enumerate(self.dListB):
-            d = int(m[1]) - int(self.dListA[c][1]) # poly count difference
-            meshA = "fileA:" + str( self.dListA[c][0] )
-            meshB = "fileB:" + str( self.dListB[c][0] )
-            pc = mc.polyCompare(meshA, meshB, v=1, e=1, fd=1) # polyCompare for good measure
-            
-            if d != 0 or pc != 0:
-                misList.append([m[0], d, pc])
+        loaded = None
+        for a, b in mcc.topologyChanges(self.match.pairs):
+            if loaded is None:
+                if self.live:
+                    self.loadScene()
+                loaded = self.meshA.isLoaded() and self.meshB.isLoaded()
+            pc = None # cached snapshots that aren't referenced can't be explained
+            if loaded:
+                pc = mc.polyCompare(sceneName(self.meshA.nspace, a), sceneName(self.meshB.nspace, b), v=1, e=1, fd=1) # polyCompare to explain what changed
+            misList.append((a, b, pc))
+        return misList
+        
+    
+    def polyCompare(self):
+        misList = [[b.name, b.faces - a.faces, pc] for a, b, pc in self.topologyCompare()]
                 
         if not misList:
             return [["_CLEAR_",0,0]]
         return [misList]
         
+        
+    def pointCompare(self, thresholds=mcc.DEFAULT_THRESHOLDS):
+        # Same point hash means nothing moved
+        pairs = [(a, b) for a, b in self.match.pairs if a.vertices == b.vertices and a.points != b.points]
+        if self.snapA.hasPoints and self.snapB.hasPoints:
+            pointsA = [self.snapA.getPoints(a) for a, b in pairs]
+            pointsB = [self.snapB.getPoints(b) for a, b in pairs]
+        else:
+            self.loadScene()
+            pointsA = [getPointArray(sceneName(self.meshA.nspace, a)) for a, b in pairs]
+            pointsB = [getPointArray(sceneName(self.meshB.nspace, b)) for a, b in pairs]
+        diffs = mcc.diffPointBatch(pointsA, pointsB, thresholds)
+        
+        return [(b, d) for (a, b), d in zip(pairs, diffs) if mcc.isMoved(d, thresholds)]
+        
+        
+    def loadScene(self):
+        self.meshA.ensureLoaded()
+        self.meshB.ensureLoaded()
+        
+        
+    def report(self, thresholds=mcc.DEFAULT_THRESHOLDS):
+        return mcc.buildReport(self.match, self.snapA.source, self.snapB.source,
+                               self.topologyCompare(), self.pointCompare(thresholds), thresholds)
+        
             
+# Scene path of a snapshot record inside a reference namespace
+def sceneName(nspace, mesh):
+    return '|'.join(nspace + ":" + n if n else n for n in mesh.path.split('|'))
     
     
 
@@ -289,27 +395,97 @@ def loadMeshes(pathA, pathB, *args):
             mc.confirmDialog( title='Error', message="Valid alembic paths not found.", defaultButton='OK',cancelButton='OK',button=['OK'],icn="critical")
             return
             
-    fileA = Mesh("fileA", _pA)
-    fileA.reference()
-    fileA.store()
+    loadModels(_pA, _pB, snapshotCache, reference=False, workers=True)
+
+
+
+# mayapy of the running Maya install, runs the snapshot workers
+def getMayapy():
+    names = ['mayapy.exe', 'mayapy'] if os.name == 'nt' else ['mayapy']
+    location = os.environ.get('MAYA_LOCATION')
+    if location:
+        for n in names:
+            p = os.path.join(location, 'bin', n)
+            if os.path.isfile(p):
+                return p
+    return shutil.which('mayapy')
+
+
+# Snapshot uncached files in parallel headless worker processes, one per file.
+# Anything a worker fails on is left uncached and gets loaded in this session as before.
+def extractInWorkers(paths, cache, jobs=None):
+    mayapy = getMayapy()
+    if not mayapy or not cache:
+        return
+    command = [mayapy, os.path.abspath(__file__), '--extract']
+    for r in mcc.extractSnapshots(paths, cache, command, jobs):
+        if not r.ok:
+            print("\nSnapshot worker failed for " + r.source + ", loading it in this session instead\n" + r.log[-2000:])
+
+
+# Worker side of extractInWorkers: reference one file and write its snapshot to output
+def extractSnapshot(source, output):
+    m = Mesh("extract", source)
+    m.ensureLoaded()
+    m.store(output)
+
+
+
+# Reference both models and store their snapshots.
+# Files already in the snapshot cache aren't walked again, and with reference=False they aren't referenced either.
+# With workers, uncached files are snapshotted in parallel worker processes first, only what they failed on is referenced here.
+def loadModels(pathA, pathB, cache=None, reference=True, workers=False, jobs=None):
+    if workers:
+        extractInWorkers([pathA, pathB], cache, jobs)
+    
+    files = []
+    for nspace, path in (("fileA", pathA), ("fileB", pathB)):
+        m = Mesh(nspace, path, cache)
+        cached = m.isCached()
+        if reference or not cached:
+            m.ensureLoaded()
+        if not cached:
+            m.store()
+        files.append(m)
+    
+    return files
+    
+    
+    
+# Snapshots for an ordered list of model versions, .lxmc files are used as they are and alembics go through the cache.
+# Uncached alembics go to parallel workers first, whatever is left is referenced one at a time and removed again once stored.
+def loadHistory(paths, cache, workers=False, jobs=None):
+    if workers:
+        extractInWorkers([p for p in paths if not p.lower().endswith(mcc.SNAPSHOT_EXT)], cache, jobs)
     
-    fileB = Mesh("fileB", _pB)
-    fileB.reference()
-    fileB.store()
+    snaps = []
+    for i, path in enumerate(paths):
+        if path.lower().endswith(mcc.SNAPSHOT_EXT):
+            snaps.append(mcc.Snapshot(path))
+            continue
+        m = Mesh("history{}".format(i), path, cache)
+        if not m.isCached():
+            m.ensureLoaded()
+            m.store()
+            m.unload()
+        snaps.append(m.snapshot())
+    
+    return snaps
 
 
 
 # Retrieve data and compare.
-def compareMeshes(pathA, pathB, *args):
+def compareMeshes(pathA, pathB, vertexTol, bboxTol, *args):
     _pA = mc.textField(pathA, query=True, text=True) 
     _pB = mc.textField(pathB, query=True, text=True)
-    
-    _l = ["fileA","fileB"]
-    for _ in _l:
-        try:
-            mc.select(_+":*") # quick check if meshes are loaded (refine later)
-        except:
-            mc.confirmDialog( title='Error', message="Meshes were not loaded first or no longer properly exist in scene in expected namespaces.", defaultButton='OK',cancelButton='OK',button=['OK'],icn="critical")
+    thresholds = mcc.Thresholds(
+        vertex = mc.floatField(vertexTol, query=True, v=True),
+        bbox = mc.floatField(bboxTol, query=True, v=True),
+    )
+    
+    for _ in (Mesh("fileA", _pA, snapshotCache), Mesh("fileB", _pB, snapshotCache)):
+        if not _.isCached(): # snapshots are all the comparison needs, the scene is only used to explain topology changes
+            mc.confirmDialog( title='Error', message="Meshes were not loaded first, click Load Meshes for these paths.", defaultButton='OK',cancelButton='OK',button=['OK'],icn="critical")
             return
             
     now = datetime.now()
@@ -326,7 +502,7 @@ def compareMeshes(pathA, pathB, *args):
     
     
     #initialize Supervisor object to spit out comparison data
-    supe = Supervisor( Mesh("fileA", _pA), Mesh("fileB", _pB) )
+    supe = Supervisor( Mesh("fileA", _pA, snapshotCache), Mesh("fileB", _pB, snapshotCache), live=True )
     
     
     # Mesh Count Check
@@ -346,6 +522,9 @@ def compareMeshes(pathA, pathB, *args):
     print("\n\nB-only meshes: \n")
     for m in mNames[1]:
         print(str(m) + "\n")
+    print("\n\nRenamed meshes (A -> B): \n")
+    for a, b in supe.renameCompare():
+        print(a + "  ->  " + b + "\n")
         
         
     # Topology Check
@@ -354,7 +533,7 @@ def compareMeshes(pathA, pathB, *args):
     polyDif = polyDif[0]
     
     if polyDif[0] == "_CLEAR_":
-        print("No poly count changes between same-named meshes.\n")
+        print("No topology changes between matched meshes.\n")
         
     else:
         print("\nMesh changes B - A: \n")
@@ -372,31 +551,148 @@ def compareMeshes(pathA, pathB, *args):
             _t = topoParse.get(m[2], " Cmds topology fail. ")
         
             print(str(m[0]) + ":  Change of " + str(m[1]) + " polygons.  //  "+ _t + "\n")
+            
+            
+    # Point Position Check
+    print("\n\n\n####     POINT POSITION CHECK     ####\n")
+    print("Vertex tolerance: " + str(thresholds.vertex) + "  //  BBox tolerance: " + str(thresholds.bbox) + "\n")
+    moved = supe.pointCompare(thresholds)
+    
+    if not moved:
+        print("No point changes between matched meshes.\n")
+        
+    else:
+        print("\nMoved meshes B - A: \n")
+        for m, d in moved:
+            print("{0}:  {1} verts moved  //  max {2:.6f}  mean {3:.6f}  rms {4:.6f}  //  bbox delta {5:.6f}\n".format(
+                m.name, d.changedVertices, d.maxDistance, d.meanDistance, d.rmsDistance, d.bboxDelta))
 
 
 
+# Mass operations are split into plan and execute phases: the plan resolves every pair, transform and
+# shading group up front from the snapshots and API, execute applies it with one sets call per set/shading
+# group inside a single undo chunk. PhaseTimer logs how long each phase took.
+class PhaseTimer(object):
+    def __init__(self, title):
+        self.title = title
+        self.phases = []
+    
+    @contextlib.contextmanager
+    def __call__(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+    
+    def report(self):
+        print("\n####     " + self.title + " TIMING     ####\n")
+        for name, seconds in self.phases:
+            print("{0}:  {1:.3f}s\n".format(name, seconds))
+        print("total:  {0:.3f}s\n".format(sum(t for n, t in self.phases)))
+
+
+# Everything in one undo chunk, so one undo reverts the whole mass operation
+@contextlib.contextmanager
+def undoChunk(name):
+    mc.undoInfo(openChunk=True, chunkName=name)
+    try:
+        yield
+    finally:
+        mc.undoInfo(closeChunk=True)
+
+
+# Parent transform of a snapshot record in the scene, straight from the stored dag path
+def sceneTransform(nspace, mesh):
+    return sceneName(nspace, mesh).rsplit('|', 1)[0]
+
+
+# Sorted indices as "start:end" ranges for component strings
+def getIndexRanges(indices):
+    ranges = []
+    for i in indices:
+        if ranges and ranges[-1][1] == i - 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    return ['{0}:{1}'.format(a, b) if a != b else str(a) for a, b in ranges]
+
+
+# Shading groups of many meshes at once: {shape full path: [(shadingGroup, faceIndices or None for the whole mesh), ...]}
+# One listConnections over every shape finds the shading groups, then one sets query per shading group gives its
+# members, which are resolved to dag paths and face indices by the API without further command round-trips.
+# Whole mesh assignments come first, then the shading group covering the most faces.
+def getShaderAssignments(shapes):
+    assignments = collections.defaultdict(list)
+    existing = mc.ls(shapes, long=True)
+    if not existing:
+        return assignments
+    wanted = set(existing)
+    for sg in sorted(set(mc.listConnections(existing, type='shadingEngine', source=False, destination=True) or [])):
+        sel = om2.MSelectionList()
+        for member in mc.sets(sg, q=True) or []:
+            try:
+                sel.add(member)
+            except RuntimeError:
+                continue # Not a dag member (e.g. a nurbs or deleted node), nothing to copy from
+        for i in range(sel.length()):
+            try:
+                path, component = sel.getComponent(i)
+                if not path.hasFn(om2.MFn.kMesh):
+                    continue
+                path.extendToShape()
+            except RuntimeError:
+                continue
+            shape = path.fullPathName()
+            if shape not in wanted:
+                continue
+            faces = None
+            if not component.isNull():
+                faces = np.sort(np.array(om2.MFnSingleIndexedComponent(component).getElements(), dtype=np.int64))
+            assignments[shape].append((sg, faces))
+    for shape, assignment in assignments.items():
+        assignment.sort(key=lambda item: -1 if item[1] is None else -len(item[1]))
+    return assignments
+
+
+# Plan: {shadingGroup: [members in B]}. Pairs with identical topology keep per-face assignments,
+# anything else gets the main shading group of A (see getShaderAssignments) on the whole mesh.
+def planShaders(supe):
+    plan = collections.OrderedDict()
+    pairs = [(a, b, sceneName(supe.meshA.nspace, a), sceneName(supe.meshB.nspace, b)) for a, b in supe.match.pairs]
+    assignments = getShaderAssignments([tA for a, b, tA, tB in pairs])
+    for a, b, tA, tB in pairs:
+        assignment = assignments.get(tA)
+        if not assignment:
+            print("\nError trying to assign "+tA)
+            continue
+        
+        if len(assignment) == 1 or not mcc.sameTopology(a, b):
+            plan.setdefault(assignment[0][0], []).append(tB)
+            continue
+        for sg, faces in assignment:
+            if faces is None:
+                plan.setdefault(sg, []).append(tB)
+            elif len(faces):
+                plan.setdefault(sg, []).extend('{0}.f[{1}]'.format(tB, r) for r in getIndexRanges(faces))
+    return plan
+
+
+def executeShaders(plan):
+    for sg, members in plan.items():
+        try:
+            mc.sets(members, edit=True, forceElement=sg)
+        except (RuntimeError, ValueError):
+            print("\nError trying to assign "+sg)
+
+
 # Mass blendshape for a quick visual comparison.
 def blendAll(pathA, pathB, autoShader, autoSet, *args):
     _pA = mc.textField(pathA, query=True, text=True) 
     _pB = mc.textField(pathB, query=True, text=True)
     shd = mc.checkBox(autoShader, query=True, v=True)
     aSet = mc.checkBox(autoSet, query=True, v=True)
-    
-    #initialize Supervisor object
-    supe = Supervisor( Mesh("fileA", _pA), Mesh("fileB", _pB) )
-    c = supe.compList()
-    mA = c[0]
-    mB = c[1]
-    
-    
-    if shd==1:
-        bldBlinn = pm.shadingNode('blinn', asShader=True)
-        pm.setAttr(bldBlinn + '.color', (0.8,0.2,0.2) )
-        bldSG = pm.sets (renderable = True, noSurfaceShader = True, empty = True)
-        pm.connectAttr('%s.outColor' %bldBlinn, '%s.surfaceShader' %bldSG)
-    
-    if aSet==1:
-        mayaSet = mc.sets(n="modCompare_BlendSet", t="Made by ayModCompare automatically", em=True)
+    timer = PhaseTimer("MASS BLENDSHAPE")
     
     now = datetime.now()
     dt_string = now.strftime("%d\%m\%Y %H:%M:%S")
@@ -410,21 +706,36 @@ def blendAll(pathA, pathB, autoShader, autoSet, *args):
     print("MESH B:  "+ _pB +"\n")
     print("##################################\n")
     
+    # Plan: transforms of every pair from the snapshot paths
+    with timer("plan"):
+        supe = Supervisor( Mesh("fileA", _pA, snapshotCache), Mesh("fileB", _pB, snapshotCache) )
+        supe.loadScene()
+        plan = [(sceneTransform("fileA", a), sceneTransform("fileB", b)) for a, b in supe.match.pairs]
+    
+    with undoChunk("lx_modelCompare_blendAll"):
+        with timer("blendshape"):
+            blended = []
+            for tA, tB in plan:
+                try:
+                    mc.blendShape(tA, tB, weight=[0,1.0])
+                    blended.append(tB)
+                except (RuntimeError, ValueError):
+                    print("\nError trying to blendshape "+tB)
+        
+        with timer("sets"):
+            if shd==1 and blended:
+                bldBlinn = mc.shadingNode('blinn', asShader=True)
+                mc.setAttr(bldBlinn + '.color', 0.8, 0.2, 0.2, type='double3')
+                bldSG = mc.sets(renderable=True, noSurfaceShader=True, empty=True)
+                mc.connectAttr('%s.outColor' %bldBlinn, '%s.surfaceShader' %bldSG)
+                mc.sets(blended, edit=True, forceElement=bldSG)
+            
+            if aSet==1:
+                mayaSet = mc.sets(n="modCompare_BlendSet", t="Made by ayModCompare automatically", em=True)
+                if blended:
+                    mc.sets(blended, edit=True, forceElement=mayaSet)
     
-    for c, m in enumerate(mB):
-        try:
-            tA = mc.listRelatives("fileA:"+str(mA[c][0]), type='transform', p=True)[0]
-            tB = mc.listRelatives("fileB:"+str(m[0]), type='transform', p=True)[0]
-            try:
-                bld = mc.blendShape(tA, tB, weight=[0,1.0])
-                if shd==1:
-                    pm.sets(bldSG, edit=True, forceElement=tB)
-                if aSet==1:
-                    pm.sets(mayaSet, edit=True, forceElement=tB)
-            except:
-                print("\nError trying to blendshape "+tB)
-        except IndexError:
-            print("\nError trying to blendshape "+str(m[0]))
+    timer.report()
             
 
 
@@ -446,25 +757,108 @@ def assignShader(self):
 def copyShaders(pathA, pathB, *args):
     _pA = mc.textField(pathA, query=True, text=True) 
     _pB = mc.textField(pathB, query=True, text=True)
-
-    #initialize Supervisor object
-    supe = Supervisor( Mesh("fileA", _pA), Mesh("fileB", _pB) )
-    c = supe.compList()
-    mA = c[0]
-    mB = c[1]
-    
-    
-    for c, m in enumerate(mA):
-        try:
-            tA = "fileA:"+m[0]
-            tB = "fileB:"+mB[c][0]
-            try:
-                shadingGrp = mc.listConnections(tA,type='shadingEngine')[0]
-                pm.sets(shadingGrp, edit=True, forceElement=tB)
-            except:
-                print("\nError trying to assign "+tA)
-        except IndexError:
-            print("\nError trying to assign "+str(m[0]))
+    timer = PhaseTimer("ASSIGN SHADERS")
+    
+    with timer("plan"):
+        supe = Supervisor( Mesh("fileA", _pA, snapshotCache), Mesh("fileB", _pB, snapshotCache) )
+        supe.loadScene()
+        plan = planShaders(supe)
+    
+    with undoChunk("lx_modelCompare_copyShaders"):
+        with timer("assign"):
+            executeShaders(plan)
+    
+    timer.report()
+
+
+
+### ########## ###
+### BATCH MODE ###
+### ########## ###
+
+
+# maya.cmds stays empty in mayapy until maya.standalone is initialized
+def isMayaRunning():
+    return hasattr(mc, 'about')
+
+
+# Start a standalone Maya session unless we're already inside one, only needed once something gets referenced
+def initStandalone():
+    if not isMayaRunning():
+        import maya.standalone
+        maya.standalone.initialize(name='python')
+    mc.loadPlugin('AbcImport', quiet=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare alembic model versions and write a diff report.')
+    parser.add_argument('paths', nargs='+', help='Old and new alembic, or every version in order with --history')
+    parser.add_argument('-o', '--output', default='-', help='Report file, .csv writes CSV, .txt the history change matrix and anything else JSON. '
+                                                            'Default prints JSON, or the change matrix with --history')
+    parser.add_argument('--history', action='store_true', help='Per-mesh change timeline over all given versions (.abc or {} snapshots)'.format(mcc.SNAPSHOT_EXT))
+    parser.add_argument('--changed-only', action='store_true', help='Leave unchanged meshes out of the history')
+    parser.add_argument('-j', '--jobs', type=int, help='Maximum number of snapshot worker processes (default: one per uncached file, up to the core count)')
+    parser.add_argument('--in-process', action='store_true', help='Snapshot uncached files in this process instead of worker processes')
+    parser.add_argument('--extract', action='store_true', help='Worker mode: paths are <alembic> <snapshot output>')
+    parser.add_argument('--cache', help='Snapshot cache folder. Default is ${0} or the user cache folder'.format(mcc.CACHE_ENV))
+    parser.add_argument('--hash', action='store_true', help='Also key cached snapshots on a hash of the file contents')
+    parser.add_argument('--fallback', choices=sorted(mcc.MATCH_KEYS), default='path', help='Second matching pass for meshes not matched by name')
+    parser.add_argument('--no-spatial', action='store_true', help='Skip spatial matching of renamed meshes by topology and bbox')
+    parser.add_argument('--vertex-tol', type=float, default=mcc.DEFAULT_THRESHOLDS.vertex, help='Distance a vertex must move to count as changed')
+    parser.add_argument('--bbox-tol', type=float, default=mcc.DEFAULT_THRESHOLDS.bbox, help='Bbox movement that counts as changed')
+    args = parser.parse_args(argv)
+    # Maya resolves relative reference paths against the workspace, not the current directory
+    args.paths = [os.path.abspath(p) for p in args.paths]
+    
+    if args.extract:
+        if len(args.paths) != 2:
+            parser.error('--extract needs an alembic and an output path')
+        extractSnapshot(args.paths[0], args.paths[1])
+        return 0
+    
+    if not args.history and len(args.paths) != 2:
+        parser.error('needs exactly two files, or --history for more')
+    for p in args.paths:
+        if not os.path.isfile(p):
+            sys.stderr.write("File not found: {}\n".format(p))
+            return 2
+    
+    cache = mcc.SnapshotCache(args.cache, args.hash)
+    thresholds = mcc.Thresholds(vertex=args.vertex_tol, bbox=args.bbox_tol)
+    try:
+        if args.history:
+            snaps = loadHistory(args.paths, cache, not args.in_process, args.jobs)
+            history = mcc.buildHistory(snaps, thresholds, args.fallback, not args.no_spatial)
+            mcc.writeHistory(history, args.output, args.changed_only)
+            return 1 if mcc.historyChanged(history) else 0
+        
+        fileA, fileB = loadModels(args.paths[0], args.paths[1], cache, reference=False, workers=not args.in_process, jobs=args.jobs)
+        supe = Supervisor(fileA, fileB, args.fallback, not args.no_spatial)
+        report = supe.report(thresholds)
+        mcc.writeReport(report, args.output)
+    except Exception as e:
+        sys.stderr.write("Model compare failed: {}\n".format(e))
+        return 2
     
+    return 1 if report['changed'] else 0
+
+
+
+def run(*args):
+    createUI('lx_modelCompare')
+
+
+# Only a mayapy launch of this file takes the command line, pasting or exec'ing it in the
+# Script Editor also runs it as __main__ but with Maya's own argv, so that opens the UI instead
+def isCommandLine():
+    if os.path.splitext(os.path.basename(sys.argv[0] if sys.argv else ''))[0] == 'lx_modelCompare':
+        return True
+    if not isMayaRunning():
+        return True # No GUI session without maya.cmds
+    return mc.about(batch=True)
+
 
-createUI('lx_modelCompare')
\ No newline at end of file
+if __name__ == '__main__':
+    if isCommandLine():
+        sys.exit(main())
+    run()
@@ -0,0 +1,775 @@
+# Maya-free core for lx_modelCompare.
+# Holds the model snapshot format, mesh matching, geometry diff math, diff reports and version history
+# so they can run and be tested anywhere.
+#
+# A snapshot is a small binary file with one fixed-size record per mesh:
+#   header  | magic, version, flags, mesh count, record size, points/string table offsets, source path length
+#   records | name, dag path, vertex/edge/face counts, topology hash, point hash, world bbox, uv set names, points offset
+#   points  | optional float64 world xyz per vertex, 8 byte aligned, referenced by offset from the records
+#   strings | utf-8 string table referenced by offset/length from the records (source path comes first)
+# Records are sorted by name. Files are memory mapped on load, so opening a snapshot costs the same
+# regardless of asset size, records are only unpacked when they're accessed and point arrays are zero-copy views.
+
+import os
+import sys
+import csv
+import json
+import mmap
+import struct
+import hashlib
+import array
+import subprocess
+import collections
+from concurrent import futures
+
+import numpy as np
+
+
+SNAPSHOT_MAGIC = b'LXMC'
+SNAPSHOT_VERSION = 2
+SNAPSHOT_EXT = '.lxmc'
+
+# Header flags
+SNAPSHOT_POINTS = 1
+
+# magic, version, flags, mesh count, record size, points offset, string table offset, string table size, source length
+HEADER = struct.Struct('<4sHHIIQQQI')
+# name off/len, path off/len, vertices, edges, faces, topology hash, point hash, bbox min/max xyz, uv names off/len, points offset
+RECORD = struct.Struct('<IIIIIIIQQ6dIIQ')
+
+# index is the record position inside a loaded snapshot, None for records that were never written
+MeshRecord = collections.namedtuple('MeshRecord', 'name path vertices edges faces topology points bbox uvSets index', defaults=(None,))
+
+
+
+### ####### ###
+### HASHING ###
+### ####### ###
+
+
+# 64 bit hash of a byte buffer
+def hashBytes(*buffers):
+    h = hashlib.blake2b(digest_size=8)
+    for b in buffers:
+        h.update(b)
+    return struct.unpack('<Q', h.digest())[0]
+
+
+# Hash of face-vertex counts and face-vertex indices, any change in connectivity changes it
+def getTopologyHash(counts, connects):
+    return hashBytes(array.array('i', counts).tobytes(), b'|', array.array('i', connects).tobytes())
+
+
+# Hash of the xyz float64 bytes of a point buffer (flat xyz or an array, see asPointArray)
+def getPointsHash(points):
+    return hashBytes(np.ascontiguousarray(asPointArray(points)).tobytes())
+
+
+# World bbox (minx, miny, minz, maxx, maxy, maxz) of a point buffer
+def getBBox(points):
+    a = asPointArray(points)
+    if not len(a):
+        return (0.0,) * 6
+    return tuple(float(v) for v in np.concatenate((a.min(axis=0), a.max(axis=0))))
+
+
+
+### ######### ###
+### SNAPSHOTS ###
+### ######### ###
+
+
+# Strip namespaces from every level of a dag path or node name
+def stripNamespace(name):
+    return '|'.join(n.split(':')[-1] for n in name.split('|'))
+
+
+# Write a snapshot of MeshRecords for a source file. Written to a temp file and renamed into place.
+# points is an optional list of point arrays aligned with meshes, stored so later diffs don't need Maya.
+def writeSnapshot(path, source, meshes, points=None):
+    order = sorted(range(len(meshes)), key=lambda i: (meshes[i].name, meshes[i].path))
+    strings = bytearray()
+    pointData = []
+    pointsSize = 0
+
+    def addString(s):
+        data = s.encode('utf-8')
+        offset = len(strings)
+        strings.extend(data)
+        return offset, len(data)
+
+    sourceLen = addString(source)[1]
+    records = bytearray()
+    for i in order:
+        m = meshes[i]
+        nameOff, nameLen = addString(m.name)
+        pathOff, pathLen = addString(m.path)
+        uvOff, uvLen = addString('\0'.join(m.uvSets))
+        pointsOff = pointsSize
+        if points is not None:
+            p = np.ascontiguousarray(asPointArray(points[i]), dtype='<f8')
+            if len(p) != m.vertices:
+                raise ValueError('{0} has {1} vertices but {2} points'.format(m.path, m.vertices, len(p)))
+            pointData.append(p)
+            pointsSize += p.nbytes
+        records += RECORD.pack(nameOff, nameLen, pathOff, pathLen, m.vertices, m.edges, m.faces,
+                               m.topology, m.points, *(tuple(m.bbox) + (uvOff, uvLen, pointsOff)))
+
+    recordsEnd = HEADER.size + len(records)
+    pointsOffset = (recordsEnd + 7) & ~7
+    stringsOffset = pointsOffset + pointsSize
+    flags = SNAPSHOT_POINTS if points is not None else 0
+    header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, flags, len(meshes), RECORD.size,
+                         pointsOffset, stringsOffset, len(strings), sourceLen)
+    tmpPath = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmpPath, 'wb') as f:
+        f.write(header)
+        f.write(records)
+        f.write(b'\0' * (pointsOffset - recordsEnd))
+        for p in pointData:
+            f.write(p.tobytes())
+        f.write(strings)
+    os.replace(tmpPath, path)
+
+
+# Read-only, memory mapped view of a snapshot file
+class Snapshot(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < HEADER.size or self.data[:4] != SNAPSHOT_MAGIC:
+            self.data.close()
+            raise ValueError('Not a model snapshot: {}'.format(path))
+        magic, version, self.flags, self.count, recordSize, self.pointsOffset, self.stringsOffset, stringsSize, sourceLen = HEADER.unpack_from(self.data, 0)
+        if version != SNAPSHOT_VERSION or recordSize != RECORD.size:
+            self.data.close()
+            raise ValueError('Unsupported snapshot version {0}: {1}'.format(version, path))
+        self.source = self.getString(0, sourceLen)
+
+    def getString(self, offset, length):
+        start = self.stringsOffset + offset
+        return self.data[start:start + length].decode('utf-8')
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        r = RECORD.unpack_from(self.data, HEADER.size + index * RECORD.size)
+        uvNames = self.getString(r[15], r[16])
+        return MeshRecord(self.getString(r[0], r[1]), self.getString(r[2], r[3]), r[4], r[5], r[6],
+                          r[7], r[8], r[9:15], uvNames.split('\0') if uvNames else [], index)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    # Name of a record without unpacking the rest of it
+    def getName(self, index):
+        nameOff, nameLen = struct.unpack_from('<II', self.data, HEADER.size + index * RECORD.size)
+        return self.getString(nameOff, nameLen)
+
+    # Binary search on the sorted names, returns the first record with that name or None
+    def find(self, name):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.getName(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.getName(lo) == name:
+            return self[lo]
+        return None
+
+    @property
+    def hasPoints(self):
+        return bool(self.flags & SNAPSHOT_POINTS)
+
+    # Read-only (N, 3) view of a record's stored points, straight out of the memory map
+    def getPoints(self, mesh):
+        if not self.hasPoints:
+            raise ValueError('Snapshot has no points: {}'.format(self.path))
+        index = mesh if isinstance(mesh, int) else mesh.index
+        vertices = struct.unpack_from('<I', self.data, HEADER.size + index * RECORD.size + 16)[0]
+        offset = struct.unpack_from('<Q', self.data, HEADER.size + (index + 1) * RECORD.size - 8)[0]
+        return np.frombuffer(self.data, dtype='<f8', count=vertices * 3, offset=self.pointsOffset + offset).reshape(-1, 3)
+
+    def close(self):
+        # Point views still alive keep the map open, it's released once they're gone
+        try:
+            self.data.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+### ############## ###
+### SNAPSHOT CACHE ###
+### ############## ###
+
+# Snapshots keyed on the identity of the source file instead of the current scene's project.
+# The key is the absolute path, size and mtime (plus a content hash if asked for), so an unchanged
+# alembic is never referenced or walked twice and any edit to it gets a fresh snapshot.
+# Lives in $LX_MODELCOMPARE_CACHE, or lx_modelCompare under the user cache folder.
+
+CACHE_ENV = 'LX_MODELCOMPARE_CACHE'
+
+
+def getCacheRoot():
+    root = os.environ.get(CACHE_ENV)
+    if not root:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        root = os.path.join(base, 'lx_modelCompare')
+    return root
+
+
+def getFileHash(path, blockSize=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class SnapshotCache(object):
+    def __init__(self, root=None, useHash=False):
+        self.root = root or getCacheRoot()
+        self.useHash = useHash
+        self.keys = {}
+
+    # (absolute path, size, mtime, content hash or '') of a source file
+    def getIdentity(self, source):
+        source = os.path.normcase(os.path.abspath(source))
+        st = os.stat(source)
+        identity = (source, st.st_size, st.st_mtime_ns)
+        if identity not in self.keys:
+            self.keys[identity] = getFileHash(source) if self.useHash else ''
+        return identity + (self.keys[identity],)
+
+    def getKey(self, source):
+        return '{:016x}'.format(hashBytes(repr(self.getIdentity(source)).encode('utf-8')))
+
+    def getPath(self, source):
+        key = self.getKey(source)
+        return os.path.join(self.root, key[:2], key + SNAPSHOT_EXT)
+
+    def contains(self, source):
+        snap = self.get(source)
+        if snap is None:
+            return False
+        snap.close()
+        return True
+
+    # Cached snapshot of a source file or None. Unreadable or old format entries count as missing.
+    def get(self, source):
+        path = self.getPath(source)
+        if not os.path.isfile(path):
+            return None
+        try:
+            return Snapshot(path)
+        except (ValueError, OSError, struct.error):
+            return None
+
+    def put(self, source, meshes, points=None):
+        path = self.getPath(source)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        writeSnapshot(path, os.path.abspath(source), meshes, points)
+        return path
+
+
+
+### ########## ###
+### EXTRACTION ###
+### ########## ###
+
+# Snapshots for uncached files are written by independent worker processes, one per file, so loading
+# several big assets takes about as long as the slowest one. A worker is any command that takes
+# <source> <output> as its last two arguments and writes a snapshot to output: mayapy running
+# lx_modelCompare.py --extract in production, or a stub writing synthetic snapshots in tests.
+
+ExtractResult = collections.namedtuple('ExtractResult', 'source path ok log')
+
+
+def runExtractor(command, source, output):
+    proc = subprocess.run(list(command) + [source, output], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    log = proc.stdout.decode('utf-8', 'replace')
+    return proc.returncode, log
+
+
+# Extract every source missing from the cache in parallel, returns one ExtractResult per source
+def extractSnapshots(sources, cache, command, jobs=None):
+    results = collections.OrderedDict()
+    pending = []
+    for source in sources:
+        if source in results:
+            continue
+        if cache.contains(source):
+            results[source] = ExtractResult(source, cache.getPath(source), True, '')
+        else:
+            results[source] = None
+            pending.append(source)
+
+    if pending:
+        # Default is one worker per file up to the core count
+        jobs = max(1, min(jobs or os.cpu_count() or 1, len(pending)))
+        with futures.ThreadPoolExecutor(jobs) as executor:
+            work = {}
+            for source in pending:
+                output = cache.getPath(source)
+                folder = os.path.dirname(output)
+                if not os.path.isdir(folder):
+                    os.makedirs(folder, exist_ok=True)
+                work[executor.submit(runExtractor, command, source, output)] = (source, output)
+
+            for job in futures.as_completed(work):
+                source, output = work[job]
+                try:
+                    code, log = job.result()
+                except OSError as e:
+                    code, log = -1, str(e)
+                # Trust the file, not the exit code: it has to be a readable snapshot of this version
+                ok = code == 0 and cache.contains(source)
+                results[source] = ExtractResult(source, output, ok, log)
+
+    return list(results.values())
+
+
+
+### ######## ###
+### MATCHING ###
+### ######## ###
+
+# Pairs meshes between two versions with dict lookups instead of list scans.
+# The first pass matches on normalized shape name; meshes left over on both sides can then go through a
+# second pass on a fallback key, e.g. the parent transform path (shape renamed under the same transform)
+# or the topology signature (same mesh, new name). Each pass is a single linear walk over both sides.
+# Whatever is still left goes through the spatial pass: same topology fingerprint, same place, same size.
+# Pairs found after the name pass are renames and are listed in renamed as well as pairs.
+
+MatchResult = collections.namedtuple('MatchResult', 'pairs aOnly bOnly renamed')
+
+# Spatial pass tolerance: absolute distance plus a fraction of the mesh's bbox diagonal
+SPATIAL_TOLERANCE = 1e-3
+SPATIAL_RELATIVE = 0.01
+
+
+# Shape name without namespaces or parent path
+def normalizeName(name):
+    return stripNamespace(name).split('|')[-1]
+
+
+# Full path of the transform above a shape
+def getParentPath(mesh):
+    return stripNamespace(mesh.path).rsplit('|', 1)[0]
+
+
+# Topology fingerprint: counts plus the connectivity hash stored at snapshot time.
+# Equal fingerprints mean identical face-vertex counts and indices, so no need to ask Maya.
+def getTopologyFingerprint(mesh):
+    return (mesh.vertices, mesh.edges, mesh.faces, mesh.topology)
+
+
+def sameTopology(meshA, meshB):
+    return getTopologyFingerprint(meshA) == getTopologyFingerprint(meshB)
+
+
+# Matched pairs whose topology changed between versions
+def topologyChanges(pairs):
+    return [(a, b) for a, b in pairs if not sameTopology(a, b)]
+
+
+MATCH_KEYS = {
+    'name': lambda m: normalizeName(m.name),
+    'path': getParentPath,
+    'topology': getTopologyFingerprint,
+}
+
+
+# Single hash join of two mesh lists on a key, returns (pairs, A-only, B-only)
+def hashJoin(meshesA, meshesB, key):
+    index = {}
+    for m in meshesB:
+        index.setdefault(key(m), []).append(m)
+
+    pairs = []
+    aOnly = []
+    for a in meshesA:
+        bucket = index.get(key(a))
+        if not bucket:
+            aOnly.append(a)
+            continue
+        # Same key more than once (duplicate short names in different groups), prefer the same dag path
+        pick = 0
+        if len(bucket) > 1:
+            for i, b in enumerate(bucket):
+                if b.path == a.path:
+                    pick = i
+                    break
+        pairs.append((a, bucket.pop(pick)))
+
+    bOnly = [m for bucket in index.values() for m in bucket]
+    return pairs, aOnly, bOnly
+
+
+# bbox centers and sizes of a mesh list as two (N, 3) arrays
+def getBBoxCenterSize(meshes):
+    b = np.array([m.bbox for m in meshes], dtype=np.float64).reshape(-1, 6)
+    return (b[:, :3] + b[:, 3:]) * 0.5, b[:, 3:] - b[:, :3]
+
+
+# Spatial match inside one topology bucket. bbox centers of B go into a hash grid with cells as big as the
+# largest tolerance, so every candidate within tolerance is in the 27 cells around a center.
+# Only pairs that are each other's single candidate within tolerance are kept, anything ambiguous stays unmatched.
+def spatialMatchBucket(meshesA, meshesB, tolerance, relative):
+    centerA, sizeA = getBBoxCenterSize(meshesA)
+    centerB, sizeB = getBBoxCenterSize(meshesB)
+    tolA = tolerance + relative * np.linalg.norm(sizeA, axis=1)
+    tolB = tolerance + relative * np.linalg.norm(sizeB, axis=1)
+    cell = max(tolA.max(), tolB.max())
+
+    grid = {}
+    for j, key in enumerate(map(tuple, np.floor(centerB / cell).astype(np.int64).tolist())):
+        grid.setdefault(key, []).append(j)
+
+    offsets = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)]
+    candidatesA = {}
+    candidatesB = collections.Counter()
+    for i, (x, y, z) in enumerate(np.floor(centerA / cell).astype(np.int64).tolist()):
+        candidates = [j for dx, dy, dz in offsets for j in grid.get((x + dx, y + dy, z + dz), ())]
+        if not candidates:
+            continue
+        candidates = np.array(candidates)
+        dist = (np.linalg.norm(centerB[candidates] - centerA[i], axis=1) +
+                np.linalg.norm(sizeB[candidates] - sizeA[i], axis=1))
+        found = candidates[dist <= np.maximum(tolA[i], tolB[candidates])].tolist()
+        if found:
+            candidatesA[i] = found
+            candidatesB.update(found)
+
+    return [(i, found[0]) for i, found in candidatesA.items() if len(found) == 1 and candidatesB[found[0]] == 1]
+
+
+# Pair leftovers by topology fingerprint plus bbox center and size, returns (pairs, A-only, B-only)
+def spatialMatch(meshesA, meshesB, tolerance=SPATIAL_TOLERANCE, relative=SPATIAL_RELATIVE):
+    bucketsA = {}
+    bucketsB = {}
+    for m in meshesA:
+        bucketsA.setdefault(getTopologyFingerprint(m), []).append(m)
+    for m in meshesB:
+        bucketsB.setdefault(getTopologyFingerprint(m), []).append(m)
+
+    pairs = []
+    for key, bucketA in bucketsA.items():
+        bucketB = bucketsB.get(key)
+        if bucketB:
+            pairs += [(bucketA[i], bucketB[j]) for i, j in spatialMatchBucket(bucketA, bucketB, tolerance, relative)]
+
+    matchedA = set(id(a) for a, b in pairs)
+    matchedB = set(id(b) for a, b in pairs)
+    return pairs, [m for m in meshesA if id(m) not in matchedA], [m for m in meshesB if id(m) not in matchedB]
+
+
+# Match two versions of a model, fallback is None or one of MATCH_KEYS, spatial adds the spatial pass for leftovers
+def matchMeshes(meshesA, meshesB, fallback=None, spatial=True):
+    pairs, aOnly, bOnly = hashJoin(meshesA, meshesB, MATCH_KEYS['name'])
+    renamed = []
+    if fallback and aOnly and bOnly:
+        extra, aOnly, bOnly = hashJoin(aOnly, bOnly, MATCH_KEYS[fallback])
+        renamed += extra
+    if spatial and aOnly and bOnly:
+        extra, aOnly, bOnly = spatialMatch(aOnly, bOnly)
+        renamed += extra
+    return MatchResult(pairs + renamed, aOnly, bOnly, renamed)
+
+
+
+### ############# ###
+### GEOMETRY DIFF ###
+### ############# ###
+
+# Per-vertex displacement between two versions of meshes with the same vertex count.
+# Works on plain (N, 3) arrays only, the Maya side just has to pull the points.
+# Meshes are diffed as one batch: all points are concatenated and per-mesh stats come out of
+# np.*.reduceat over the mesh boundaries, so thousands of small meshes cost a handful of numpy calls.
+
+# vertex: distance a vertex has to move to count as changed, bbox: bbox corner movement that counts as changed
+Thresholds = collections.namedtuple('Thresholds', 'vertex bbox')
+DEFAULT_THRESHOLDS = Thresholds(vertex=1e-4, bbox=1e-4)
+
+PointDiff = collections.namedtuple('PointDiff', 'maxDistance meanDistance rmsDistance changedVertices bboxDelta')
+EMPTY_DIFF = PointDiff(0.0, 0.0, 0.0, 0, 0.0)
+
+
+# (N, 3) float64 view of points given as (N, 3), (N, 4) homogeneous or flat xyz
+def asPointArray(points):
+    a = np.asarray(points, dtype=np.float64)
+    if a.ndim == 1:
+        a = a.reshape(-1, 3)
+    return a[:, :3]
+
+
+# Diff a batch of meshes, pointsA[i] against pointsB[i]. Returns one PointDiff per mesh.
+def diffPointBatch(pointsA, pointsB, thresholds=DEFAULT_THRESHOLDS):
+    arraysA = [asPointArray(p) for p in pointsA]
+    arraysB = [asPointArray(p) for p in pointsB]
+    for i, (a, b) in enumerate(zip(arraysA, arraysB)):
+        if a.shape != b.shape:
+            raise ValueError('Mesh {0} has {1} points in A and {2} in B'.format(i, len(a), len(b)))
+
+    # reduceat can't handle empty segments, those get an empty diff
+    keep = [i for i, a in enumerate(arraysA) if len(a)]
+    results = [EMPTY_DIFF] * len(arraysA)
+    if not keep:
+        return results
+
+    a = np.concatenate([arraysA[i] for i in keep])
+    b = np.concatenate([arraysB[i] for i in keep])
+    counts = np.array([len(arraysA[i]) for i in keep])
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    delta = b - a
+    distSq = np.einsum('ij,ij->i', delta, delta)
+    dist = np.sqrt(distSq)
+
+    maxDist = np.maximum.reduceat(dist, starts)
+    meanDist = np.add.reduceat(dist, starts) / counts
+    rmsDist = np.sqrt(np.add.reduceat(distSq, starts) / counts)
+    changed = np.add.reduceat((dist > thresholds.vertex).astype(np.int64), starts)
+
+    # Largest movement of any bbox min/max component
+    bboxA = np.hstack((np.minimum.reduceat(a, starts), np.maximum.reduceat(a, starts)))
+    bboxB = np.hstack((np.minimum.reduceat(b, starts), np.maximum.reduceat(b, starts)))
+    bboxDelta = np.abs(bboxB - bboxA).max(axis=1)
+
+    for j, i in enumerate(keep):
+        results[i] = PointDiff(float(maxDist[j]), float(meanDist[j]), float(rmsDist[j]), int(changed[j]), float(bboxDelta[j]))
+    return results
+
+
+def diffPoints(pointsA, pointsB, thresholds=DEFAULT_THRESHOLDS):
+    return diffPointBatch([pointsA], [pointsB], thresholds)[0]
+
+
+def isMoved(diff, thresholds=DEFAULT_THRESHOLDS):
+    return diff.changedVertices > 0 or diff.bboxDelta > thresholds.bbox
+
+
+
+
+### ####### ###
+### HISTORY ###
+### ####### ###
+
+# Change timeline of every mesh over N ordered versions. Each version is loaded once and only
+# neighbouring versions are matched, so the cost is N loads and N - 1 linear matches.
+# Meshes are followed through the matches, one timeline character per version:
+HISTORY_FIRST = '#'      # present in the first version
+HISTORY_APPEARED = '+'
+HISTORY_GONE = '-'       # disappeared in this version
+HISTORY_TOPOLOGY = 'T'
+HISTORY_MOVED = 'M'      # moved beyond the thresholds (exact point hash compare if a snapshot has no points)
+HISTORY_RENAMED = 'R'
+HISTORY_SAME = '='
+HISTORY_ABSENT = '.'
+
+History = collections.namedtuple('History', 'sources timelines')
+
+
+class MeshTimeline(object):
+    def __init__(self, mesh, versions, start, code):
+        self.name = mesh.name
+        self.path = mesh.path
+        self.codes = [HISTORY_ABSENT] * versions
+        self.codes[start] = code
+
+    @property
+    def timeline(self):
+        return ''.join(self.codes)
+
+    def getVersions(self, code):
+        return [i for i, c in enumerate(self.codes) if c == code]
+
+    @property
+    def changed(self):
+        return any(c not in (HISTORY_FIRST, HISTORY_SAME, HISTORY_ABSENT) for c in self.codes)
+
+
+# Moved flags for matched pairs between two neighbouring snapshots
+def getMovedPairs(snapA, snapB, pairs, thresholds):
+    candidates = [(a, b) for a, b in pairs if a.vertices == b.vertices and a.points != b.points]
+    if not (snapA.hasPoints and snapB.hasPoints):
+        return set((a.index, b.index) for a, b in candidates)
+    diffs = diffPointBatch([snapA.getPoints(a) for a, b in candidates], [snapB.getPoints(b) for a, b in candidates], thresholds)
+    return set((a.index, b.index) for (a, b), d in zip(candidates, diffs) if isMoved(d, thresholds))
+
+
+def buildHistory(snapshots, thresholds=DEFAULT_THRESHOLDS, fallback=None, spatial=True):
+    n = len(snapshots)
+    timelines = []
+    previous = {}
+    recordsA = list(snapshots[0]) if n else []
+    for m in recordsA:
+        previous[m.index] = MeshTimeline(m, n, 0, HISTORY_FIRST)
+        timelines.append(previous[m.index])
+
+    for v in range(1, n):
+        recordsB = list(snapshots[v])
+        match = matchMeshes(recordsA, recordsB, fallback, spatial)
+        moved = getMovedPairs(snapshots[v - 1], snapshots[v], match.pairs, thresholds)
+        renamed = set(b.index for a, b in match.renamed)
+
+        current = {}
+        for a, b in match.pairs:
+            t = previous[a.index]
+            if not sameTopology(a, b):
+                t.codes[v] = HISTORY_TOPOLOGY
+            elif (a.index, b.index) in moved:
+                t.codes[v] = HISTORY_MOVED
+            elif b.index in renamed:
+                t.codes[v] = HISTORY_RENAMED
+            else:
+                t.codes[v] = HISTORY_SAME
+            t.name, t.path = b.name, b.path
+            current[b.index] = t
+        for a in match.aOnly:
+            previous[a.index].codes[v] = HISTORY_GONE
+        for b in match.bOnly:
+            current[b.index] = MeshTimeline(b, n, v, HISTORY_APPEARED)
+            timelines.append(current[b.index])
+
+        previous = current
+        recordsA = recordsB
+
+    timelines.sort(key=lambda t: (t.path, t.name))
+    return History([s.source for s in snapshots], timelines)
+
+
+def historyChanged(history):
+    return any(t.changed for t in history.timelines)
+
+
+def getHistoryDict(history, changedOnly=False):
+    return {
+        'versions': history.sources,
+        'changed': historyChanged(history),
+        'meshes': [{
+            'name': t.name,
+            'path': t.path,
+            'timeline': t.timeline,
+            'appeared': t.getVersions(HISTORY_APPEARED),
+            'disappeared': t.getVersions(HISTORY_GONE),
+            'topology': t.getVersions(HISTORY_TOPOLOGY),
+            'moved': t.getVersions(HISTORY_MOVED),
+            'renamed': t.getVersions(HISTORY_RENAMED),
+        } for t in history.timelines if t.changed or not changedOnly],
+    }
+
+
+# Compact change matrix, one row per mesh and one column per version
+def formatHistory(history, changedOnly=False):
+    lines = ['Versions:']
+    lines += ['  {0:>3}  {1}'.format(i, source) for i, source in enumerate(history.sources)]
+    lines.append('')
+    lines.append('Legend: {0} first  {1} appeared  {2} gone  {3} topology  {4} moved  {5} renamed  {6} same  {7} absent'.format(
+        HISTORY_FIRST, HISTORY_APPEARED, HISTORY_GONE, HISTORY_TOPOLOGY, HISTORY_MOVED, HISTORY_RENAMED, HISTORY_SAME, HISTORY_ABSENT))
+    lines.append('')
+    lines.append(''.join(str(i % 10) for i in range(len(history.sources))))
+    for t in history.timelines:
+        if t.changed or not changedOnly:
+            lines.append('{0}  {1}'.format(t.timeline, t.path))
+    return '\n'.join(lines) + '\n'
+
+
+# Write a history to path: .csv gets one column per version, .txt the change matrix, anything else JSON.
+# '-' prints the change matrix.
+def writeHistory(history, path, changedOnly=False):
+    if path == '-':
+        sys.stdout.write(formatHistory(history, changedOnly))
+        return
+    lower = path.lower()
+    if lower.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'path'] + ['v{}'.format(i) for i in range(len(history.sources))])
+            for t in history.timelines:
+                if t.changed or not changedOnly:
+                    writer.writerow([t.name, t.path] + t.codes)
+    elif lower.endswith('.txt'):
+        with open(path, 'w') as f:
+            f.write(formatHistory(history, changedOnly))
+    else:
+        with open(path, 'w') as f:
+            json.dump(getHistoryDict(history, changedOnly), f, indent=2)
+
+
+
+### ####### ###
+### REPORTS ###
+### ####### ###
+
+# Machine readable diff report. JSON keeps the full structure, CSV flattens it to one row per changed mesh.
+
+REPORT_FIELDS = ['status', 'name', 'path', 'renamedFrom', 'vertexDelta', 'edgeDelta', 'faceDelta', 'polyCompare',
+                 'maxDistance', 'meanDistance', 'rmsDistance', 'changedVertices', 'bboxDelta']
+
+# topology: (meshA, meshB, polyCompare result or None) for pairs with changed topology
+# points: (meshB, PointDiff) for pairs that moved
+def buildReport(match, sourceA, sourceB, topology=(), points=(), thresholds=DEFAULT_THRESHOLDS):
+    report = {
+        'a': sourceA,
+        'b': sourceB,
+        'meshCount': {'a': len(match.pairs) + len(match.aOnly), 'b': len(match.pairs) + len(match.bOnly)},
+        'matched': len(match.pairs),
+        'thresholds': dict(thresholds._asdict()),
+        'aOnly': [{'name': m.name, 'path': m.path} for m in match.aOnly],
+        'bOnly': [{'name': m.name, 'path': m.path} for m in match.bOnly],
+        'renamed': [{'name': b.name, 'path': b.path, 'renamedFrom': a.path} for a, b in match.renamed],
+        'topology': [{
+            'name': b.name,
+            'path': b.path,
+            'vertexDelta': b.vertices - a.vertices,
+            'edgeDelta': b.edges - a.edges,
+            'faceDelta': b.faces - a.faces,
+            'polyCompare': pc,
+        } for a, b, pc in topology],
+        'points': [dict({'name': b.name, 'path': b.path}, **d._asdict()) for b, d in points],
+    }
+    report['changed'] = any(report[k] for k in ('aOnly', 'bOnly', 'renamed', 'topology', 'points'))
+    return report
+
+
+def getReportRows(report):
+    for status in ('aOnly', 'bOnly', 'renamed', 'topology', 'points'):
+        for entry in report[status]:
+            row = dict(entry)
+            row['status'] = status
+            yield row
+
+
+# Write a report to path, .csv gets CSV and anything else JSON. '-' writes JSON to stdout.
+def writeReport(report, path):
+    if path == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, REPORT_FIELDS, restval='')
+            writer.writeheader()
+            writer.writerows(getReportRows(report))
+    else:
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,175 @@
+#-----------------------------------------------------------------
+#    SCRIPT            spPaint3dBVH.py
+#
+#    DESCRIPTION:    Bounding volume hierarchies and ray casts used to speed up
+#                    target surface intersections. Pure python/numpy, no maya
+#                    dependency so it can be tested and benchmarked anywhere.
+#
+#-----------------------------------------------------------------
+
+import heapq
+
+import numpy as np
+
+sp3dLeafSize = 8 #max number of boxes/triangles per leaf
+sp3dRayEpsilon = 1e-12 #parallel ray / degenerate triangle threshold
+
+
+
+def getInverseDirection(direction):
+    '''
+    return 1/direction with zero components replaced by a tiny value so slab tests never divide by zero
+    '''
+    d = np.array(direction, dtype=np.float64)
+    d[np.abs(d) < sp3dRayEpsilon] = sp3dRayEpsilon
+    return 1.0 / d
+
+
+def rayBoxes(origin, invdir, bounds, maxdist=np.inf):
+    '''
+    slab test of one ray against (N,6) boxes (min xyz, max xyz)
+    return the entry distance of every box, np.inf for boxes that are missed or further than maxdist
+    '''
+    t1 = (bounds[:, :3] - origin) * invdir
+    t2 = (bounds[:, 3:] - origin) * invdir
+    tnear = np.maximum(np.minimum(t1, t2).max(axis=1), 0.0)
+    tfar = np.maximum(t1, t2).min(axis=1)
+    return np.where((tfar >= tnear) & (tnear <= maxdist), tnear, np.inf)
+
+
+def rayTriangles(origin, direction, v0, e1, e2, maxdist=np.inf):
+    '''
+    Moller-Trumbore intersection of one ray against N triangles given as first vertex and both edges (N,3)
+    return the hit distance of every triangle, np.inf where there is no hit in [0, maxdist]
+    '''
+    p = np.cross(direction, e2)
+    det = np.einsum('ij,ij->i', e1, p)
+    valid = np.abs(det) > sp3dRayEpsilon
+    inv = np.divide(1.0, det, out=np.zeros_like(det), where=valid)
+
+    s = origin - v0
+    u = np.einsum('ij,ij->i', s, p) * inv
+    q = np.cross(s, e1)
+    v = np.dot(q, direction) * inv
+    t = np.einsum('ij,ij->i', e2, q) * inv
+
+    hit = valid & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) & (t >= 0.0) & (t <= maxdist)
+    return np.where(hit, t, np.inf)
+
+
+
+class bvh (object):
+    '''
+    bounding volume hierarchy over a list of axis aligned boxes, built with median splits on the longest axis
+    nodes are stored in flat arrays, both children of a node are stored next to each other so they are tested together
+    '''
+    def __init__(self, bounds, leafsize=sp3dLeafSize):
+        '''
+        build the hierarchy from (N,6) boxes (min xyz, max xyz)
+        '''
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 6)
+        self.count = len(bounds)
+        self.order = np.arange(self.count) #items sorted so every node covers a contiguous range
+
+        nodeBounds = [None]
+        nodeChild = [-1] #index of the first child, -1 for leaves
+        nodeRange = [(0, self.count)]
+
+        if self.count:
+            centers = (bounds[:, :3] + bounds[:, 3:]) * 0.5
+            stack = [0]
+            while stack:
+                node = stack.pop()
+                start, end = nodeRange[node]
+                items = self.order[start:end]
+                nodeBounds[node] = np.concatenate((bounds[items, :3].min(axis=0), bounds[items, 3:].max(axis=0)))
+                if end - start <= leafsize:
+                    continue
+
+                c = centers[items]
+                extent = c.max(axis=0) - c.min(axis=0)
+                axis = int(np.argmax(extent))
+                if extent[axis] <= 0.0:
+                    #all centers on top of each other, can't split any further
+                    continue
+
+                mid = (end - start) // 2
+                self.order[start:end] = items[np.argpartition(c[:, axis], mid)]
+
+                nodeChild[node] = len(nodeChild)
+                for childRange in ((start, start + mid), (start + mid, end)):
+                    nodeBounds.append(None)
+                    nodeChild.append(-1)
+                    nodeRange.append(childRange)
+                    stack.append(len(nodeChild) - 1)
+        else:
+            nodeBounds[0] = np.zeros(6)
+
+        self.bounds = np.array(nodeBounds)
+        self.child = np.array(nodeChild)
+        self.range = np.array(nodeRange)
+
+    def closestHit(self, origin, direction, leaftest, maxdist=np.inf):
+        '''
+        walk the hierarchy nearest box first and return the closest (distance, payload) found by leaftest, None if nothing was hit
+        leaftest(start, end, maxdist) is called with the range of a leaf in self.order and must return (distance, payload) or None
+        nodes further away than the current closest hit are never visited
+        '''
+        if not self.count:
+            return None
+        origin = np.asarray(origin, dtype=np.float64)
+        invdir = getInverseDirection(direction)
+
+        best = None
+        tnear = rayBoxes(origin, invdir, self.bounds[:1], maxdist)[0]
+        heap = [(tnear, 0)] if tnear < np.inf else []
+        while heap:
+            tnear, node = heapq.heappop(heap)
+            if tnear > maxdist:
+                break
+            child = self.child[node]
+            if child < 0:
+                start, end = self.range[node]
+                hit = leaftest(start, end, maxdist)
+                if hit and hit[0] <= maxdist:
+                    best = hit
+                    maxdist = hit[0]
+            else:
+                for i, t in enumerate(rayBoxes(origin, invdir, self.bounds[child:child + 2], maxdist)):
+                    if t < np.inf:
+                        heapq.heappush(heap, (t, child + i))
+        return best
+
+
+
+class triangleBVH (object):
+    '''
+    bvh over a triangle soup, triangles are reordered along the hierarchy so every leaf is a contiguous slice
+    '''
+    def __init__(self, triangles, leafsize=sp3dLeafSize):
+        '''
+        build from (N,3,3) world space triangles
+        '''
+        triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 3)
+        self.tree = bvh(np.concatenate((triangles.min(axis=1), triangles.max(axis=1)), axis=1), leafsize)
+
+        ordered = triangles[self.tree.order]
+        self.v0 = ordered[:, 0]
+        self.e1 = ordered[:, 1] - ordered[:, 0]
+        self.e2 = ordered[:, 2] - ordered[:, 0]
+
+    def intersect(self, origin, direction, maxdist=np.inf):
+        '''
+        return (distance, triangle index in the original soup) of the closest hit along the ray, None if nothing was hit
+        '''
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+
+        def leafTest(start, end, maxdist):
+            t = rayTriangles(origin, direction, self.v0[start:end], self.e1[start:end], self.e2[start:end], maxdist)
+            i = int(np.argmin(t))
+            if t[i] == np.inf:
+                return None
+            return float(t[i]), int(self.tree.order[start + i])
+
+        return self.tree.closestHit(origin, direction, leafTest, maxdist)
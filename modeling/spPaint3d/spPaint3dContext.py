@@ -18,11 +18,21 @@ import maya.cmds as mc
 
 import maya.OpenMaya as om
 import maya.OpenMayaUI as omui
+import maya.api.OpenMaya as om2
 import math as math
 import sys
 
+import numpy as np
+
+import spPaint3dBVH as spPaint3dBVH
+import spPaint3dEngine as spPaint3dEngine
+import spPaint3dUndo as spPaint3dUndo
+
 spPaint3dContextID = "spPaint3dContext"
 spPaint3dTempGroupID = "spPaint3dTempGroup"
+spPaint3dStrokePreviewID = "spPaint3dStrokePreview"
+spPaint3dFillGroupID = "spPaint3dFillOutput"
+spPaint3dStrokeGroupID = "spPaint3dStrokeCopies"
 
 #unit conversion dictionnary relative to 1 cm (default unit system)
 sp3dUnit = {
@@ -39,6 +49,7 @@ sp3d_log = False #debug flag to log to script editor log
 sp3d_place = False #debug flag for place context
 sp3d_ramp = False #debug flag for rampFX
 sp3d_MFn = False #debug flag for MFn stuff
+sp3d_triangleBVH = False #intersect targets against our own triangle bvh instead of MFnMesh.closestIntersection
 
 class point (object):
     '''
@@ -95,6 +106,7 @@ class intersectionPoint (object):
         self.dagMeshSourceObject = None     #used to store the DAG path of the created geometry if it's actually a valid intersection
         self.generatedDAG = None    #used to store the DAG path of the created object
         self.initialScale = [1,1,1] #used to store the self.generatedDAG initial scale
+        self.fnMesh = None #cached MFnMesh of self.dagMeshTargetSurface when the intersection comes from a targetIndex
 
     def getHitNormal(self, smooth=False):
         '''
@@ -103,7 +115,7 @@ class intersectionPoint (object):
         if (smooth):
             #getting the intersection normal from the MFnMesh method
             normal = om.MVector()
-            fnMesh = om.MFnMesh( self.dagMeshTargetSurface )
+            fnMesh = self.fnMesh or om.MFnMesh( self.dagMeshTargetSurface )
             fnMesh.getClosestNormal(self.hitPoint.asMPoint(), normal, om.MSpace.kWorld, None)
 
             return normal
@@ -246,6 +258,197 @@ class intersectionList (object):
 
 
 
+class targetIndex (object):
+    '''
+    spatial index over the targetList surfaces: a bvh of the targets world bounding boxes, walked closest box first
+    so a click ray only intersects the targets it actually crosses and stops as soon as nothing closer can be hit
+    '''
+    def __init__(self, targetlist):
+        '''
+        initial setup, fetch every target dag and world bounding box from targetlist
+        '''
+        self.dagPaths = []  #MDagPath of each indexed target
+        self.meshes = []    #MFnMesh of each indexed target
+        self.accel = []     #MMeshIsectAccelParams of each indexed target
+        self.triangles = {} #triangleBVH and face/triangle mapping of each target, built on first use
+        self.matrices = []  #world matrix of each target at build time
+        self.targetNames = getTargetNames(targetlist)
+        self.callbacks = om.MCallbackIdArray()
+        self.dirty = False
+        bounds = []
+        for obj,data in targetlist.obj.items():
+            try:
+                targetDAGPath = getDAGObject(data[0])
+                fnMesh = om.MFnMesh(targetDAGPath)
+            except RuntimeError:
+                #not a valid target anymore (deleted, renamed, not a mesh)
+                if (sp3d_log): print("skipping target %s" % data[0])
+                continue
+            self.dagPaths.append(targetDAGPath)
+            self.meshes.append(fnMesh)
+            self.accel.append(fnMesh.autoUniformGridParams())
+            self.matrices.append(targetDAGPath.inclusiveMatrix())
+            bounds.append(getWorldBoundingBox(targetDAGPath))
+            #any edit of the mesh dirties its shape node
+            shapeDAGPath = om.MDagPath(targetDAGPath)
+            shapeDAGPath.extendToShape()
+            self.callbacks.append(om.MNodeMessage.addNodeDirtyCallback(shapeDAGPath.node(), self.setDirty))
+        self.tree = spPaint3dBVH.bvh(bounds, 1)
+        if (sp3d_log): print("indexed %i targets" % len(self.dagPaths))
+
+    def setDirty(self, *args):
+        '''
+        node dirty callback, flag the index to be rebuilt before the next stroke
+        '''
+        self.dirty = True
+
+    def isDirty(self, targetlist=None):
+        '''
+        return True if the index doesn't match the scene anymore: a target mesh was edited, moved or deleted, or targetlist holds different objects
+        '''
+        if (self.dirty): return True
+        if (targetlist and getTargetNames(targetlist) != self.targetNames): return True
+        for targetDAGPath, matrix in zip(self.dagPaths, self.matrices):
+            if (not targetDAGPath.isValid() or not targetDAGPath.inclusiveMatrix().isEquivalent(matrix)): return True
+        return False
+
+    def release(self):
+        '''
+        remove the node callbacks, the index shouldn't be used afterwards
+        '''
+        if (self.callbacks.length()): om.MMessage.removeCallbacks(self.callbacks)
+        self.callbacks.clear()
+
+    def intersect(self, clickPos, clickDir, farclip):
+        '''
+        return the closest intersectionPoint along the click (world pos, direction) up to farclip, None if no intersection found
+        '''
+        origin = np.array((clickPos.x, clickPos.y, clickPos.z))
+        direction = np.array((clickDir.x, clickDir.y, clickDir.z))
+        length = np.linalg.norm(direction)
+        if (not length): return None
+        direction /= length
+
+        def leafTest(start, end, maxdist):
+            closest = None
+            for target in self.tree.order[start:end]:
+                hit = self.intersectTarget(target, origin, direction, maxdist)
+                if (hit and hit[0] <= maxdist):
+                    closest = hit
+                    maxdist = hit[0]
+            return closest
+
+        hit = self.tree.closestHit(origin, direction, leafTest, farclip)
+        if (not hit): return None
+        hit[1].fnMesh = self.meshes[hit[2]]
+        return hit[1]
+
+    def intersectTarget(self, target, origin, direction, maxdist):
+        '''
+        intersect a single indexed target, return (distance, intersectionPoint, target) or None
+        '''
+        if (sp3d_triangleBVH):
+            tribvh, hitFaces, hitTriangles = self.getTriangles(target)
+            hit = tribvh.intersect(origin, direction, maxdist)
+            if (not hit): return None
+            distance, triangle = hit
+            hitPoint = origin + direction * distance
+            return distance, intersectionPoint(point(hitPoint[0], hitPoint[1], hitPoint[2]), int(hitFaces[triangle]), int(hitTriangles[triangle]), self.dagPaths[target]), target
+
+        currentHitFP = om.MFloatPoint() #current intersection
+        hitFace = om.MScriptUtil()
+        hitTri = om.MScriptUtil()
+
+        hitFace.createFromInt(0)
+        hitTri.createFromInt(0)
+
+        hitFaceptr = hitFace.asIntPtr()
+        hitTriptr = hitTri.asIntPtr()
+
+        hit = self.meshes[target].closestIntersection( om.MFloatPoint(origin[0], origin[1], origin[2]),
+                                om.MFloatVector(direction[0], direction[1], direction[2]),
+                                None,
+                                None,
+                                True,
+                                om.MSpace.kWorld,
+                                maxdist,
+                                False,
+                                self.accel[target],
+                                currentHitFP,
+                                None,
+                                hitFaceptr,
+                                hitTriptr,
+                                None,
+                                None)
+        if (not hit): return None
+        if (sp3d_MFn): print("Face Hit: %i || Tri Hit: %i" % (hitFace.getInt(hitFaceptr),hitTri.getInt(hitTriptr)))
+        hitPoint = point(currentHitFP.x, currentHitFP.y, currentHitFP.z)
+        distance = float(np.dot((hitPoint.x, hitPoint.y, hitPoint.z) - origin, direction))
+        return distance, intersectionPoint(hitPoint, hitFace.getInt(hitFaceptr), hitTri.getInt(hitTriptr), self.dagPaths[target]), target
+
+    def getTriangles(self, target):
+        '''
+        return the triangleBVH of the target world space triangles along with the face and face triangle number of each triangle
+        built on first use and kept for the lifetime of the index
+        '''
+        if (target not in self.triangles):
+            sList = om2.MSelectionList()
+            sList.add(self.dagPaths[target].fullPathName())
+            fnMesh = om2.MFnMesh(sList.getDagPath(0))
+            points = np.array(fnMesh.getPoints(om2.MSpace.kWorld), dtype=np.float64)[:, :3]
+            counts, vertices = fnMesh.getTriangles()
+            counts = np.array(counts, dtype=np.int64)
+            hitFaces = np.repeat(np.arange(len(counts)), counts)
+            hitTriangles = np.arange(len(hitFaces)) - np.repeat(np.cumsum(counts) - counts, counts)
+            tribvh = spPaint3dBVH.triangleBVH(points[np.array(vertices, dtype=np.int64)].reshape(-1, 3, 3))
+            self.triangles[target] = (tribvh, hitFaces, hitTriangles)
+        return self.triangles[target]
+
+
+
+
+class strokeBuffer (object):
+    '''
+    compact storage of the placements sampled along a buffered paint stroke, the objects are only created on release
+    every placement is a row in a set of numpy arrays grown by doubling, sources are kept in a parallel list
+    '''
+    def __init__(self, size=256):
+        '''
+        initial setup
+        '''
+        self.count = 0
+        self.sources = []                   #dag of the source object of each placement
+        self.position = np.zeros((size,3))  #hit point
+        self.normal = np.zeros((size,3))    #surface normal at the hit point (world up when not aligning)
+        self.rotate = np.zeros((size,3))    #sampled random rotation
+        self.scale = np.ones((size,3))      #sampled random scale
+        self.offset = np.zeros((size,3))    #sampled jitter and up offset
+
+    def add(self, source, position, normal, rotate, scale, offset):
+        '''
+        append a placement to the buffer
+        '''
+        if (self.count == len(self.position)):
+            for name in ('position', 'normal', 'rotate', 'scale', 'offset'):
+                array = self.__dict__[name]
+                self.__dict__[name] = np.concatenate((array, np.ones_like(array) if name == 'scale' else np.zeros_like(array)))
+        i = self.count
+        self.sources.append(source)
+        self.position[i] = (position.x, position.y, position.z)
+        self.normal[i] = (normal.x, normal.y, normal.z)
+        self.rotate[i] = rotate
+        self.scale[i] = scale
+        self.offset[i] = offset
+        self.count += 1
+
+    def getLength(self):
+        '''
+        return the number of buffered placements
+        '''
+        return self.count
+
+
+
 
 class paintContext (object):
     '''
@@ -261,6 +464,7 @@ class paintContext (object):
         mc.draggerContext(spPaint3dContextID, pressCommand=self.onPress, dragCommand=self.onDrag, releaseCommand=self.onRelease, name=spPaint3dContextID, cursor='crossHair', undoMode='step')
 
         #create context local options
+        self.targetCache = None
         self.runtimeUpdate(uioptions, transformoptions, sourcelist, targetlist)
 
         #debug purpose
@@ -298,11 +502,19 @@ class paintContext (object):
         #create the temporary group used through the stroke to store geometry as they are created
         self.tempgroup = mc.group(empty=True, name=spPaint3dTempGroupID)
 
+        #buffered stroke placements and preview, only used with the strokeBuffer option
+        self.strokeBuffer = strokeBuffer()
+        self.strokePreview = None
+
         pressPosition = mc.draggerContext(spPaint3dContextID, query=True, anchorPoint=True)
 
         worldPos, worldDir = getViewportClick(pressPosition[0],pressPosition[1])
 
-        intersected = targetSurfaceLoopIntersect(self.targetList, worldPos, worldDir)
+        #refresh the cached targets only if they changed since the last stroke, fetch the camera far clip once for the whole stroke
+        if (self.targetCache.isDirty()): self.updateTargetCache()
+        self.farclip = getCameraFarClip()
+
+        intersected = targetSurfaceLoopIntersect(self.targetList, worldPos, worldDir, self.targetCache, self.farclip)
 
         if(intersected):
             #there was a usable intersection found
@@ -321,19 +533,24 @@ class paintContext (object):
             else: intersected.dagMeshSourceObject = self.sourceList.getNext()
             if(sp3d_dbg): logDebugInfo('got the dag for the source object to use')
 
-            if(sp3d_dbg): logDebugInfo('creating object from the dag')
-            intersected.createdObjectDAG(self.createObject(intersected))
-            intersected.setInitialScale()            
-            if(sp3d_dbg): logDebugInfo('finished creating object from the dag, appending to intersection list')
-            self.strokeIntersectionList.addPoint(intersected)
+            if (self.uiValues.strokeBuffer):
+                #buffered stroke, only recording the placement, the object gets created on release
+                self.bufferObject(intersected)
+                self.strokeIntersectionList.addPoint(intersected)
+            else:
+                if(sp3d_dbg): logDebugInfo('creating object from the dag')
+                intersected.createdObjectDAG(self.createObject(intersected))
+                intersected.setInitialScale()            
+                if(sp3d_dbg): logDebugInfo('finished creating object from the dag, appending to intersection list')
+                self.strokeIntersectionList.addPoint(intersected)
 
-            if self.uiValues.jitter:
-                #jittering the created object along the U & V parameters from the UI
-                u = self.transform.getRandomJitter('uJitter')
-                v = self.transform.getRandomJitter('vJitter')
-                yOffset = math.fabs(self.worldUp.y - 1) * v
-                zOffset = math.fabs(self.worldUp.z - 1) * v
-                mc.move(u,yOffset,zOffset,intersected.generatedDAG,relative=True) 
+                if self.uiValues.jitter:
+                    #jittering the created object along the U & V parameters from the UI
+                    u = self.transform.getRandomJitter('uJitter')
+                    v = self.transform.getRandomJitter('vJitter')
+                    yOffset = math.fabs(self.worldUp.y - 1) * v
+                    zOffset = math.fabs(self.worldUp.z - 1) * v
+                    mc.move(u,yOffset,zOffset,intersected.generatedDAG,relative=True) 
 
         if(sp3d_dbg): logDebugInfo('finished paintContext onPress')
         forceRefresh()
@@ -353,7 +570,7 @@ class paintContext (object):
 
         worldPos, worldDir = getViewportClick(dragPosition[0],dragPosition[1])
 
-        intersected = targetSurfaceLoopIntersect(self.targetList, worldPos, worldDir)
+        intersected = targetSurfaceLoopIntersect(self.targetList, worldPos, worldDir, self.targetCache, self.farclip)
         if(intersected):
             #there was a usable intersection found, checking if it's coherent with the paintFlux settings
 
@@ -401,20 +618,25 @@ class paintContext (object):
                 if (self.uiValues.random): intersected.updateDAGSourceObject(self.sourceList.getRandom())
                 else: intersected.updateDAGSourceObject(self.sourceList.getNext())
 
-                intersected.createdObjectDAG(self.createObject(intersected))
-                intersected.setInitialScale()            
-                self.strokeIntersectionList.addPoint(intersected)
-                
-                if self.uiValues.jitter:
-                    #jittering the created object along the U & V parameters from the UI
-                    u = self.transform.getRandomJitter('uJitter')
-                    v = self.transform.getRandomJitter('vJitter')
-                    yOffset = math.fabs(self.worldUp.y - 1) * v
-                    zOffset = math.fabs(self.worldUp.z - 1) * v
-                    mc.move(u,yOffset,zOffset,intersected.generatedDAG,relative=True)
+                if (self.uiValues.strokeBuffer):
+                    #buffered stroke, only recording the placement, the object gets created on release
+                    self.bufferObject(intersected)
+                    self.strokeIntersectionList.addPoint(intersected)
+                else:
+                    intersected.createdObjectDAG(self.createObject(intersected))
+                    intersected.setInitialScale()            
+                    self.strokeIntersectionList.addPoint(intersected)
                     
-                if self.uiValues.realTimeRampFX:
-                    self.rampFX(self.strokeIntersectionList) 
+                    if self.uiValues.jitter:
+                        #jittering the created object along the U & V parameters from the UI
+                        u = self.transform.getRandomJitter('uJitter')
+                        v = self.transform.getRandomJitter('vJitter')
+                        yOffset = math.fabs(self.worldUp.y - 1) * v
+                        zOffset = math.fabs(self.worldUp.z - 1) * v
+                        mc.move(u,yOffset,zOffset,intersected.generatedDAG,relative=True)
+                        
+                    if self.uiValues.realTimeRampFX:
+                        self.rampFX(self.strokeIntersectionList) 
                     
                 
         if(sp3d_dbg): logDebugInfo('finished paintContext onDrag')
@@ -464,37 +686,42 @@ class paintContext (object):
         '''
         on mouse release event: CLEANUP & rampFX if needed
         '''
-        if not self.uiValues.realTimeRampFX:
+        if (self.uiValues.strokeBuffer):
+            #buffered stroke, creating all the recorded objects in one go (rampFX included)
+            self.flushStrokeBuffer()
+        elif not self.uiValues.realTimeRampFX:
             self.rampFX(self.strokeIntersectionList)
         
         if(self.uiValues.hierarchy):
-            #grouping objects
+            #grouping objects, sorting them first so every group gets a single parent command
+            groups = {}
             if (self.uiValues.group==0.0):
                 #single group sorting
                 groupName = self.uiValues.getGroupID()
-                for obj in self.strokeIntersectionList.intersectionList:
-                    #print("object created: %s (using source: %s) || will be sorted here: %s" % (obj.generatedDAG, obj.dagMeshSourceObject, groupName))
-                    if (not mc.objExists(groupName)): groupName = mc.group(empty=True, name=groupName)
-                    mc.parent(obj.generatedDAG, groupName, relative=True)
+                if (not mc.objExists(groupName)): groupName = mc.group(empty=True, name=groupName)
+                groups[groupName] = [obj.generatedDAG for obj in self.strokeIntersectionList.intersectionList]
 
             elif (self.uiValues.group==1.0):
                 #stroke group sorting
                 groupName = mc.group(empty=True, name='spPaint3dStrokeOutput')
-                for obj in self.strokeIntersectionList.intersectionList:
-                    #print("object created: %s (using source: %s) || will be sorted here: %s" % (obj.generatedDAG, obj.dagMeshSourceObject, groupName))
-                    mc.parent(obj.generatedDAG, groupName, relative=True)
+                groups[groupName] = [obj.generatedDAG for obj in self.strokeIntersectionList.intersectionList]
 
             elif (self.uiValues.group==2.0):
                 #source group sorting
+                sourceGroups = {}
                 for obj in self.strokeIntersectionList.intersectionList:
                     #print("object created: %s (using source: %s) || will be sorted here: %s" % (obj.generatedDAG, obj.dagMeshSourceObject, groupName))
-                    shapeParent = mc.listRelatives(obj.dagMeshSourceObject, parent=True, f=1)
-                    groupName = 'spPaint3dOutput_' + shapeParent[0]
-                    if(not mc.objExists(groupName)):
-                        #group doesnt exists, creating
-                        groupName = mc.group(name=groupName, empty=True)
-
-                    mc.parent(obj.generatedDAG, groupName, relative=True)
+                    if (obj.dagMeshSourceObject not in sourceGroups):
+                        shapeParent = mc.listRelatives(obj.dagMeshSourceObject, parent=True, f=1)
+                        groupName = 'spPaint3dOutput_' + shapeParent[0]
+                        if(not mc.objExists(groupName)):
+                            #group doesnt exists, creating
+                            groupName = mc.group(name=groupName, empty=True)
+                        sourceGroups[obj.dagMeshSourceObject] = groupName
+                    groups.setdefault(sourceGroups[obj.dagMeshSourceObject], []).append(obj.generatedDAG)
+
+            for groupName, objects in groups.items():
+                if (objects): mc.parent(objects, groupName, relative=True)
 
         #last cleanup, removing the temp group
         if mc.objExists(self.tempgroup):
@@ -505,6 +732,80 @@ class paintContext (object):
                 mc.delete(self.tempgroup)
 
 
+    def bufferObject(self, intersection):
+        '''
+        sample the ui and transform options for the intersection and record the resulting placement in self.strokeBuffer
+        '''
+        if (self.uiValues.align): normal = intersection.getHitNormal(self.uiValues.smoothNormal)
+        else: normal = self.worldUp
+
+        if (self.uiValues.transformRotate and not self.uiValues.rampFX): randrotate = self.transform.getRandomRotate()
+        else: randrotate = (0,0,0)
+
+        if (self.uiValues.transformScale and not self.uiValues.rampFX): randscale = self.transform.getRandomScale(self.uiValues.transformScaleUniform)
+        else: randscale = (1,1,1)
+
+        offset = [self.uiValues.upOffset*self.worldUp.x,self.uiValues.upOffset*self.worldUp.y,self.uiValues.upOffset*self.worldUp.z]
+        if self.uiValues.jitter:
+            #jittering along the U & V parameters from the UI
+            u = self.transform.getRandomJitter('uJitter')
+            v = self.transform.getRandomJitter('vJitter')
+            offset[0] += u
+            offset[1] += math.fabs(self.worldUp.y - 1) * v
+            offset[2] += math.fabs(self.worldUp.z - 1) * v
+
+        self.strokeBuffer.add(intersection.dagMeshSourceObject, intersection.hitPoint, normal, randrotate, randscale, offset)
+        self.updateStrokePreview(intersection.hitPoint)
+
+    def updateStrokePreview(self, hitPoint):
+        '''
+        extend the preview curve drawn along the buffered stroke with hitPoint
+        '''
+        position = (hitPoint.x, hitPoint.y, hitPoint.z)
+        if (not self.strokePreview or not mc.objExists(self.strokePreview)):
+            self.strokePreview = mc.curve(degree=1, point=[position, position], name=spPaint3dStrokePreviewID)
+        else:
+            mc.curve(self.strokePreview, append=True, degree=1, point=[position])
+
+    def flushStrokeBuffer(self):
+        '''
+        create all the objects recorded in self.strokeBuffer, compute their transforms (rampFX included) and set them in one pass
+        '''
+        if (self.strokePreview and mc.objExists(self.strokePreview)): mc.delete(self.strokePreview)
+        self.strokePreview = None
+
+        count = self.strokeBuffer.getLength()
+        if (not count): return
+        buffer = self.strokeBuffer
+
+        #same transforms as createObject (rampFX included), computed for the whole stroke by the placement engine from the sampled values
+        sources = sorted(set(buffer.sources))
+        sourceIndex = dict((source, i) for i, source in enumerate(sources))
+        sourceTransforms = dict((source, getSourceTransform(source)) for source in sources)
+        settings = spPaint3dEngine.placementSettings.fromOptions(self.uiValues, self.transform, (self.worldUp.x, self.worldUp.y, self.worldUp.z))
+        placements = spPaint3dEngine.getPlacements(buffer.position[:count], buffer.normal[:count], [sourceIndex[source] for source in buffer.sources], sources, settings,
+                                                   sourceTransforms=sourceTransforms, rotate=buffer.rotate[:count], scale=buffer.scale[:count], offset=buffer.offset[:count])
+
+        #copies are created in bulk under a scratch group (see createCopies), then handed over to where createObject would have put them:
+        #the stroke temp group when grouping, next to their source otherwise. parenting is relative so the written transforms are kept
+        group = mc.group(empty=True, name=spPaint3dStrokeGroupID)
+        created = writePlacements(placements, self.uiValues.instance, self.uiValues.preserveConn, group)
+        if (self.uiValues.hierarchy): parents = dict((source, self.tempgroup) for source in sources)
+        else: parents = dict((source, (mc.listRelatives(mc.listRelatives(source, parent=True, f=1)[0], parent=True, f=1) or [None])[0]) for source in sources)
+        rows = {}
+        for i, source in enumerate(buffer.sources[:count]): rows.setdefault(parents[source], []).append(i)
+        for parent, parentRows in rows.items():
+            objects = [created[i] for i in parentRows]
+            if (parent): names = mc.parent(objects, parent, relative=True)
+            else: names = mc.parent(objects, world=True, relative=True)
+            for i, name in zip(parentRows, names): created[i] = (parent or '') + '|' + name.split('|')[-1]
+        mc.delete(group)
+
+        for intersection, dag, scale in zip(self.strokeIntersectionList.intersectionList, created, placements.scale):
+            intersection.createdObjectDAG(dag)
+            intersection.initialScale = list(scale)
+        if (sp3d_log): print("created %i buffered objects" % len(created))
+
     def createObject(self,intersection):
         '''
         will create the object at the intersection object gathered data, pending all ui and transform options
@@ -573,6 +874,23 @@ class paintContext (object):
         self.sourceList = sourcelist
         self.targetList = targetlist
 
+        #only rebuild the cached targets if the target list (or the targets themselves) changed
+        if (not self.targetCache or self.targetCache.isDirty(targetlist)): self.updateTargetCache()
+
+    def updateTargetCache(self):
+        '''
+        (re)build the cached target state used to intersect the targets, releasing the previous one
+        '''
+        if (self.targetCache): self.targetCache.release()
+        self.targetCache = targetIndex(self.targetList)
+
+    def release(self):
+        '''
+        release the cached target state callbacks, called by the GUI before dropping the context
+        '''
+        if (self.targetCache): self.targetCache.release()
+        self.targetCache = None
+
 
 
 class modifierManager (object):
@@ -766,6 +1084,7 @@ class placeContext (object):
         mc.draggerContext(spPaint3dContextID, pressCommand=self.onPress, prePressCommand=self.onBeforePress, dragCommand=self.onDrag, holdCommand=self.onHold, releaseCommand=self.onRelease, name=spPaint3dContextID, cursor='crossHair', undoMode='step')
 
         #create context local options
+        self.targetCache = None
         self.runtimeUpdate(uioptions, transformoptions, sourcelist, targetlist)
 
         #initialise world up vector
@@ -885,7 +1204,11 @@ class placeContext (object):
 
         worldPos, worldDir = getViewportClick(pressPosition[0],pressPosition[1])
 
-        intersected = targetSurfaceLoopIntersect(self.targetList, worldPos, worldDir)
+        #refresh the cached targets only if they changed since the last stroke, fetch the camera far clip once for the whole stroke
+        if (self.targetCache.isDirty()): self.updateTargetCache()
+        self.farclip = getCameraFarClip()
+
+        intersected = targetSurfaceLoopIntersect(self.targetList, worldPos, worldDir, self.targetCache, self.farclip)
         if(intersected):
             #there was a usable intersection found
             #first checking and converting units if necessary
@@ -929,7 +1252,7 @@ class placeContext (object):
         #
         #TODO scale and rotate depending on mouse drag direction
         #
-        intersected = targetSurfaceLoopIntersect(self.targetList, worldPos, worldDir)
+        intersected = targetSurfaceLoopIntersect(self.targetList, worldPos, worldDir, self.targetCache, self.farclip)
         if(intersected):
             #there was a usable intersection found
             #first checking and converting units if necessary
@@ -1043,6 +1366,23 @@ class placeContext (object):
         self.sourceList = sourcelist
         self.targetList = targetlist
 
+        #only rebuild the cached targets if the target list (or the targets themselves) changed
+        if (not self.targetCache or self.targetCache.isDirty(targetlist)): self.updateTargetCache()
+
+    def updateTargetCache(self):
+        '''
+        (re)build the cached target state used to intersect the targets, releasing the previous one
+        '''
+        if (self.targetCache): self.targetCache.release()
+        self.targetCache = targetIndex(self.targetList)
+
+    def release(self):
+        '''
+        release the cached target state callbacks, called by the GUI before dropping the context
+        '''
+        if (self.targetCache): self.targetCache.release()
+        self.targetCache = None
+
 
 
 #-------------------------------
@@ -1098,6 +1438,138 @@ def getEulerRotationQuaternion(upvector, directionvector):
     return math.degrees(quatAsEuler.x), math.degrees(quatAsEuler.y), math.degrees(quatAsEuler.z)
 
 
+def getSourceTransform(source):
+    '''
+    return the translate (compensated for the scale pivot like moveTo), rotate and scale of the transform of the source shape as numpy arrays
+    '''
+    tempDAG = mc.listRelatives(source, parent=True, f=1)[0]
+    scalePivot = mc.xform(tempDAG, query=True, ws=True, sp=True)
+    transform = mc.xform(tempDAG, query=True, ws=True, t=True)
+    rotate = mc.xform(tempDAG, query=True, ro=True)
+    scale = mc.xform(tempDAG, query=True, scale=True, r=True)
+
+    return np.subtract(transform, scalePivot), np.array(rotate), np.array(scale)
+
+
+def writePlacements(placements, instance=False, preserveConn=False, group=None):
+    '''
+    create the objects of (source, translate, rotate, scale) placements (list or spPaint3dEngine.placementRecords) and return their DAG paths
+    objects are instanced/duplicated first, then all the transforms are set at full precision by one undoable API modifier (see setTransforms)
+    without group every object is created next to its source, one command each. with a group name they are created in bulk under it
+    (a sub group per source, see createCopies), which is the way to go for large amounts of objects
+    '''
+    placements = list(placements)
+    created = []
+    if (group):
+        rows = {}
+        for i, placement in enumerate(placements): rows.setdefault(placement[0], []).append(i)
+        created = [None] * len(placements)
+        for source, sourceRows in rows.items():
+            for i, dag in zip(sourceRows, createCopies(source, len(sourceRows), group, instance, preserveConn)): created[i] = dag
+    else:
+        sourceDAGs = {}
+        for source, translate, rotate, scale in placements:
+            if (source not in sourceDAGs):
+                #fetching the transform for that shape (instance dont create object of child objects if it's the shape that gets instanced)
+                sourceDAGs[source] = mc.listRelatives(source, parent=True, f=1)[0]
+            if (instance): newObjectDAG = mc.instance(sourceDAGs[source])
+            else: newObjectDAG = mc.duplicate(sourceDAGs[source], ic=preserveConn)
+            created.append(newObjectDAG[0])
+
+    setTransforms(created, [placement[1:] for placement in placements])
+
+    return created
+
+
+def setTransforms(dags, transforms):
+    '''
+    set the local translate (current scene unit), rotate (degrees) and scale of every dag from its (translate, rotate, scale) transform
+    all the plug values go through a single om2.MDGModifier run as one spPaint3dModifier command, so it's one undo record for the whole batch
+    '''
+    if (not dags): return
+    sList = om2.MSelectionList()
+    for dag in dags: sList.add(dag)
+    unit = om2.MDistance.uiUnit()
+    modifier = om2.MDGModifier()
+    for i, (translate, rotate, scale) in enumerate(transforms):
+        fnNode = om2.MFnDependencyNode(sList.getDependNode(i))
+        for axis in range(3):
+            modifier.newPlugValueMDistance(fnNode.findPlug('translate' + 'XYZ'[axis], False), om2.MDistance(float(translate[axis]), unit))
+            modifier.newPlugValueMAngle(fnNode.findPlug('rotate' + 'XYZ'[axis], False), om2.MAngle(float(rotate[axis]), om2.MAngle.kDegrees))
+            modifier.newPlugValueDouble(fnNode.findPlug('scale' + 'XYZ'[axis], False), float(scale[axis]))
+    spPaint3dUndo.doModifier(modifier)
+
+
+def createCopies(source, count, group, instance=False, preserveConn=False):
+    '''
+    create count instances/duplicates of the source transform in a new sub group of group and return their DAG paths
+    the copies are duplicated as a whole selection, doubling their number every time, so it only takes log2(count) duplicate commands
+    '''
+    sourceDAG = mc.listRelatives(source, parent=True, f=1)[0]
+    sourceGroup = mc.group(empty=True, parent=group, name=sourceDAG.split('|')[-1] + '_' + spPaint3dFillGroupID)
+    if (instance): newObjectDAG = mc.instance(sourceDAG)
+    else: newObjectDAG = mc.duplicate(sourceDAG, ic=preserveConn)
+    mc.parent(newObjectDAG[0], sourceGroup, relative=True)
+
+    copies = 1
+    while (copies < count):
+        children = mc.listRelatives(sourceGroup, children=True, f=1)[:count - copies]
+        if (instance): mc.duplicate(children, instanceLeaf=True)
+        else: mc.duplicate(children, ic=preserveConn)
+        copies += len(children)
+
+    return mc.listRelatives(sourceGroup, children=True, f=1)
+
+
+def fillTargets(targetlist, sourcelist, uioptions, transformoptions, count, density=None):
+    '''
+    fill mode: scatter count objects uniformly by area over the targetlist surfaces with the ui/transform options and return their DAG paths
+    objects are created in bulk under a new spPaint3dFillOutput group, the whole fill is a single undo step
+    density: optional per target vertex weights (see spPaint3dEngine.sampleSurfaces)
+    '''
+    engine = getPlacementEngine(targetlist, sourcelist, uioptions, transformoptions)
+    records = engine.fill(int(count), density)
+    if (not len(records)): return []
+
+    mc.undoInfo(openChunk=True, chunkName='spPaint3dFill')
+    try:
+        group = mc.group(empty=True, name=spPaint3dFillGroupID)
+        created = writePlacements(records, uioptions.instance, uioptions.preserveConn, group)
+    finally:
+        mc.undoInfo(closeChunk=True)
+    if (sp3d_log): print("filled %i objects in %s" % (len(created), group))
+    return created
+
+
+def getTargetSurface(dagstring, unit='cm'):
+    '''
+    return the spPaint3dEngine.targetSurface of the dagstring mesh (world space points converted to unit, triangles and vertex normals)
+    '''
+    sList = om2.MSelectionList()
+    sList.add(dagstring)
+    fnMesh = om2.MFnMesh(sList.getDagPath(0))
+    points = np.array(fnMesh.getPoints(om2.MSpace.kWorld), dtype=np.float64)[:, :3] * sp3dUnit[unit]
+    counts, vertices = fnMesh.getTriangles()
+    normals = np.array(fnMesh.getVertexNormals(False, om2.MSpace.kWorld), dtype=np.float64)
+
+    return spPaint3dEngine.targetSurface(points, np.array(vertices, dtype=np.int64).reshape(-1, 3), normals, dagstring)
+
+
+def getPlacementEngine(targetlist, sourcelist, uioptions, transformoptions, seed=None):
+    '''
+    return a spPaint3dEngine.placementEngine built from the GUI lists and options, used to script placements (in the current scene unit)
+    its records are written to the scene with writePlacements(records, uioptions.instance, uioptions.preserveConn)
+    '''
+    if ( (mc.upAxis(q=True, axis=True)) == "z" ): worldUp = (0.0, 0.0, 1.0)
+    else: worldUp = (0.0, 1.0, 0.0)
+    sources = sorted(data[0] for data in sourcelist.obj.values())
+    unit = mc.currentUnit(query=True, linear=True)
+    targets = [getTargetSurface(dagstring, unit) for dagstring in getTargetNames(targetlist)]
+    settings = spPaint3dEngine.placementSettings.fromOptions(uioptions, transformoptions, worldUp)
+
+    return spPaint3dEngine.placementEngine(targets, sources, settings, dict((source, getSourceTransform(source)) for source in sources), seed)
+
+
 def getViewportClick(screenX, screenY):
     '''
     return world position and direction of the viewport clicked point (returns point objects)
@@ -1131,21 +1603,15 @@ def getCameraFarClip():
     return camFn.farClippingPlane()
 
 
-def targetSurfaceLoopIntersect(targetList, clickPos, clickDir):
+def targetSurfaceLoopIntersect(targetList, clickPos, clickDir, index=None, farclip=None):
     '''
-    loop through all the object in targetList and intersect them with click (world pos, direction). creates an intersectionPoint object for each intersection
-    sort the list of intersection and return the closest intersectionPoint object from the click world position, return None if no intersection found
+    intersect the objects in targetList with click (world pos, direction), only the targets whose world bounding box is crossed are tested, closest first
+    return the closest intersectionPoint object from the click world position, return None if no intersection found
+    index is a targetIndex built from targetList and farclip the camera far clip, pass them to reuse them over a whole stroke
     '''
-    ilist = intersectionList()
-    farclip = getCameraFarClip()
-    for obj,data in targetList.obj.items():
-        #loop through each object in the targetList
-        intersected = intersectTargetSurface(data[0], clickPos, clickDir, farclip)
-        if (intersected):
-            #got meh an intersected
-            ilist.addPoint(intersected)
-
-    return ilist.getClosest(clickPos)
+    if (index is None): index = targetIndex(targetList)
+    if (farclip is None): farclip = getCameraFarClip()
+    return index.intersect(clickPos, clickDir, farclip)
 
 
 def intersectTargetSurface(targetdag, clickPos, clickDir, farclip=1.0):
@@ -1195,6 +1661,27 @@ def intersectTargetSurface(targetdag, clickPos, clickDir, farclip=1.0):
 
 
 
+def getTargetNames(targetlist):
+    '''
+    return the sorted dag strings of the objects in targetlist
+    '''
+    return sorted(data[0] for data in targetlist.obj.values())
+
+
+def getWorldBoundingBox(dagPath):
+    '''
+    return the world space bounding box of the dagPath shape as a (min x,y,z, max x,y,z) tuple, slightly padded to absorb float precision
+    '''
+    shapeDAGPath = om.MDagPath(dagPath)
+    shapeDAGPath.extendToShape()
+    bbox = om.MFnDagNode(shapeDAGPath).boundingBox()
+    bbox.transformUsing(shapeDAGPath.inclusiveMatrix())
+    bmin = bbox.min()
+    bmax = bbox.max()
+    pad = 1e-4 * (bmax - bmin).length() + 1e-6
+    return (bmin.x-pad, bmin.y-pad, bmin.z-pad, bmax.x+pad, bmax.y+pad, bmax.z+pad)
+
+
 def getDAGObject(dagstring):
     '''
     return the DAG Api object from the dagstring argument
@@ -0,0 +1,496 @@
+#-----------------------------------------------------------------
+#    SCRIPT            spPaint3dEngine.py
+#
+#    DESCRIPTION:    Headless placement engine. Turns rays or surface points into
+#                    placement records (source, position, rotation, scale) using
+#                    the same options as the paint/place contexts, with all the
+#                    math vectorized. Pure python/numpy, no maya dependency so it
+#                    can be scripted, batched and benchmarked anywhere; the
+#                    contexts write the records to the scene with writePlacements.
+#
+#-----------------------------------------------------------------
+
+import numpy as np
+
+import spPaint3dBVH as spPaint3dBVH
+
+sp3dWorldUp = (0.0, 1.0, 0.0)
+sp3dEpsilon = 1e-12 #degenerate vector threshold
+
+
+
+class placementSettings (object):
+    '''
+    placement options, same attribute names and defaults as sp3dToolOption (ui options) and sp3dTransform (transform ranges)
+    '''
+    def __init__(self, **options):
+        '''
+        initialise attributes, any keyword overrides the matching default
+        '''
+        #sp3dToolOption equivalents
+        self.align = True
+        self.smoothNormal = False
+        self.transformRotate = True
+        self.transformScale = True
+        self.transformScaleUniform = True
+        self.random = True
+        self.jitter = False
+        self.rampFX = 0 #0=none, 1=rotate, 2=scale, 3=both
+        self.upOffset = 0
+        self.paintFlux = True #only the distance flux makes sense without a timer
+        self.paintDistance = 10
+        #sp3dTransform equivalents
+        self.rotate = ((0, 0), (0, 0), (0, 0))
+        self.scale = ((1, 1), (1, 1), (1, 1))
+        self.uJitter = (0, 0)
+        self.vJitter = (0, 0)
+        #scene
+        self.worldUp = sp3dWorldUp
+
+        for name, value in options.items():
+            if (name not in self.__dict__): raise AttributeError("unknown placement setting: %s" % name)
+            self.__dict__[name] = value
+
+    @classmethod
+    def fromOptions(cls, uioptions, transformoptions, worldUp=sp3dWorldUp):
+        '''
+        build the settings from the GUI sp3dToolOption and sp3dTransform objects
+        '''
+        settings = cls(worldUp=worldUp)
+        for name in settings.__dict__:
+            if (name in ('rotate', 'scale', 'uJitter', 'vJitter')): settings.__dict__[name] = transformoptions.__dict__[name]
+            elif (name in uioptions.__dict__): settings.__dict__[name] = uioptions.__dict__[name]
+        return settings
+
+
+
+class targetSurface (object):
+    '''
+    world space triangle mesh used as a placement target
+    '''
+    def __init__(self, points, triangles, normals=None, name=None):
+        '''
+        points: (V,3) world positions, triangles: (T,3) vertex indices, normals: optional (V,3) vertex normals used for smooth normals
+        '''
+        self.name = name
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        self.normals = None if normals is None else np.asarray(normals, dtype=np.float64).reshape(-1, 3)
+        self.bvh = None
+
+    def getCorners(self, triangles=None):
+        '''
+        return the (N,3,3) corner positions of the triangles (all of them by default)
+        '''
+        if (triangles is None): return self.points[self.triangles]
+        return self.points[self.triangles[triangles]]
+
+    def getAreas(self):
+        '''
+        return the (T,) area of every triangle
+        '''
+        corners = self.getCorners()
+        return 0.5 * np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1)
+
+    def getBVH(self):
+        '''
+        return the triangleBVH of the surface, built on first use
+        '''
+        if (self.bvh is None): self.bvh = spPaint3dBVH.triangleBVH(self.getCorners())
+        return self.bvh
+
+    def getNormals(self, triangles, positions, smooth=False):
+        '''
+        return the unit normals at positions lying on triangles
+        hard normals are the triangle normals, smooth ones interpolate the vertex normals (falls back to hard ones without vertex normals)
+        '''
+        corners = self.getCorners(triangles)
+        e1 = corners[:, 1] - corners[:, 0]
+        e2 = corners[:, 2] - corners[:, 0]
+        if (not smooth or self.normals is None): return normalize(np.cross(e1, e2))
+
+        #barycentric coordinates of the positions
+        p = positions - corners[:, 0]
+        d00 = np.einsum('ij,ij->i', e1, e1)
+        d01 = np.einsum('ij,ij->i', e1, e2)
+        d11 = np.einsum('ij,ij->i', e2, e2)
+        d20 = np.einsum('ij,ij->i', p, e1)
+        d21 = np.einsum('ij,ij->i', p, e2)
+        denom = d00 * d11 - d01 * d01
+        denom[np.abs(denom) < sp3dEpsilon] = 1.0
+        v = (d11 * d20 - d01 * d21) / denom
+        w = (d00 * d21 - d01 * d20) / denom
+        u = 1.0 - v - w
+
+        vertexNormals = self.normals[self.triangles[triangles]]
+        return normalize(u[:, None] * vertexNormals[:, 0] + v[:, None] * vertexNormals[:, 1] + w[:, None] * vertexNormals[:, 2])
+
+
+
+class placementRecords (object):
+    '''
+    result of a placement: one row per object to create, sources are indices into self.sources
+    iterating yields (source, translate, rotate, scale) tuples, the format writePlacements expects
+    '''
+    def __init__(self, sources, source, position, rotate, scale):
+        '''
+        initial setup
+        '''
+        self.sources = list(sources)
+        self.source = np.asarray(source, dtype=np.int64)
+        self.position = np.asarray(position, dtype=np.float64).reshape(-1, 3)
+        self.rotate = np.asarray(rotate, dtype=np.float64).reshape(-1, 3) #xyz euler, degrees
+        self.scale = np.asarray(scale, dtype=np.float64).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.source)
+
+    def __iter__(self):
+        for i in range(len(self.source)):
+            yield self.sources[self.source[i]], self.position[i], self.rotate[i], self.scale[i]
+
+
+
+class placementEngine (object):
+    '''
+    place sources on target surfaces from rays (paint strokes, scripted clicks) or surface points
+    '''
+    def __init__(self, targets, sources, settings=None, sourceTransforms=None, seed=None):
+        '''
+        targets: list of targetSurface, sources: list of source names
+        sourceTransforms: optional {source: (translate, rotate, scale)} base transform of each source, see getPlacements
+        seed: random seed, placements are reproducible for a given seed
+        '''
+        self.targets = list(targets)
+        self.sources = list(sources)
+        self.settings = settings or placementSettings()
+        self.sourceTransforms = sourceTransforms or {}
+        self.rng = np.random.default_rng(seed)
+        self.next = 0 #next source index in sequential mode
+
+        bounds = [np.concatenate((t.points.min(axis=0), t.points.max(axis=0))) if len(t.points) else np.zeros(6) for t in self.targets]
+        self.tree = spPaint3dBVH.bvh(bounds, 1)
+
+    def intersect(self, origins, directions, maxdist=np.inf):
+        '''
+        intersect the rays with the targets and keep the closest hit of each ray
+        return (hit mask, positions, normals, target index, triangle index) for the N rays, only valid where hit is True
+        '''
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = normalize(np.asarray(directions, dtype=np.float64).reshape(-1, 3))
+        count = len(origins)
+        hit = np.zeros(count, dtype=bool)
+        distance = np.zeros(count)
+        target = np.zeros(count, dtype=np.int64)
+        triangle = np.zeros(count, dtype=np.int64)
+
+        for i in range(count):
+            def leafTest(start, end, maxdist):
+                closest = None
+                for t in self.tree.order[start:end]:
+                    h = self.targets[t].getBVH().intersect(origins[i], directions[i], maxdist)
+                    if (h and h[0] <= maxdist):
+                        closest = (h[0], (t, h[1]))
+                        maxdist = h[0]
+                return closest
+            h = self.tree.closestHit(origins[i], directions[i], leafTest, maxdist)
+            if (h):
+                hit[i] = True
+                distance[i] = h[0]
+                target[i], triangle[i] = h[1]
+
+        positions = origins + directions * distance[:, None]
+        normals = np.zeros((count, 3))
+        for t in np.unique(target[hit]):
+            rows = hit & (target == t)
+            normals[rows] = self.targets[t].getNormals(triangle[rows], positions[rows], self.settings.smoothNormal)
+        return hit, positions, normals, target, triangle
+
+    def placeRays(self, origins, directions, stroke=False, maxdist=np.inf):
+        '''
+        return the placementRecords of the rays hitting a target
+        stroke treats the rays as a paint stroke: a hit is only kept paintDistance away from the previous kept one
+        '''
+        hit, positions, normals, target, triangle = self.intersect(origins, directions, maxdist)
+        positions, normals = positions[hit], normals[hit]
+        if (stroke and len(positions)):
+            keep = getStrokeSpacing(positions, self.settings.paintDistance)
+            positions, normals = positions[keep], normals[keep]
+        return self.placePoints(positions, normals)
+
+    def placePoints(self, positions, normals=None):
+        '''
+        return the placementRecords of objects placed at positions with the surface normals (world up when None)
+        '''
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        count = len(positions)
+        if (normals is None): normals = np.tile(self.settings.worldUp, (count, 1))
+        return getPlacements(positions, normals, self.pickSources(count), self.sources, self.settings, self.rng, self.sourceTransforms)
+
+    def fill(self, count, density=None):
+        '''
+        return the placementRecords of count objects scattered uniformly by area over all the targets
+        density: optional list (one entry per target) of (V,) vertex weights in [0,1] thinning the scatter, see sampleSurfaces
+        '''
+        target, triangle, positions = sampleSurfaces(self.targets, count, self.rng, density)
+        normals = np.zeros((len(positions), 3))
+        for t in np.unique(target):
+            rows = target == t
+            normals[rows] = self.targets[t].getNormals(triangle[rows], positions[rows], self.settings.smoothNormal)
+        return self.placePoints(positions, normals)
+
+    def pickSources(self, count):
+        '''
+        return count source indices, random or sequential (cycling) like sp3dObjectList getRandom/getNext
+        '''
+        if (self.settings.random): return self.rng.integers(0, len(self.sources), count)
+        picked = (self.next + np.arange(count)) % len(self.sources)
+        self.next += count
+        return picked
+
+
+
+#-------------------------------
+# Vectorized math
+#-------------------------------
+
+def normalize(vectors):
+    '''
+    return the (N,3) vectors scaled to unit length, null vectors are left untouched
+    '''
+    length = np.linalg.norm(vectors, axis=1)
+    length[length < sp3dEpsilon] = 1.0
+    return vectors / length[:, None]
+
+
+def getAlignQuaternion(upvector, directions):
+    '''
+    return the (N,4) x,y,z,w quaternions of the shortest arc rotations from upvector to each direction (same as MQuaternion(up, direction))
+    '''
+    up = np.asarray(upvector, dtype=np.float64)
+    up = up / np.linalg.norm(up)
+    directions = normalize(np.asarray(directions, dtype=np.float64).reshape(-1, 3))
+
+    quat = np.empty((len(directions), 4))
+    quat[:, :3] = np.cross(up, directions)
+    quat[:, 3] = 1.0 + directions.dot(up)
+
+    #opposite vectors: half turn around any axis perpendicular to up
+    opposite = quat[:, 3] < sp3dEpsilon
+    if (opposite.any()):
+        axis = np.cross(up, (1.0, 0.0, 0.0))
+        if (np.linalg.norm(axis) < 1e-6): axis = np.cross(up, (0.0, 1.0, 0.0))
+        quat[opposite, :3] = axis / np.linalg.norm(axis)
+        quat[opposite, 3] = 0.0
+
+    return quat / np.linalg.norm(quat, axis=1)[:, None]
+
+
+def getQuaternionMatrix(quat):
+    '''
+    return the (N,3,3) rotation matrices (column vectors, v' = M.v) of (N,4) x,y,z,w quaternions
+    '''
+    x, y, z, w = quat[:, 0], quat[:, 1], quat[:, 2], quat[:, 3]
+    m = np.empty((len(quat), 3, 3))
+    m[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    m[:, 0, 1] = 2 * (x * y - z * w)
+    m[:, 0, 2] = 2 * (x * z + y * w)
+    m[:, 1, 0] = 2 * (x * y + z * w)
+    m[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    m[:, 1, 2] = 2 * (y * z - x * w)
+    m[:, 2, 0] = 2 * (x * z - y * w)
+    m[:, 2, 1] = 2 * (y * z + x * w)
+    m[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return m
+
+
+def getEulerMatrix(rotate):
+    '''
+    return the (N,3,3) rotation matrices (column vectors) of (N,3) xyz euler rotations in degrees, x applied first like maya's xyz rotate order
+    '''
+    rx, ry, rz = np.radians(np.asarray(rotate, dtype=np.float64).reshape(-1, 3)).T
+    cx, sx = np.cos(rx), np.sin(rx)
+    cy, sy = np.cos(ry), np.sin(ry)
+    cz, sz = np.cos(rz), np.sin(rz)
+    m = np.empty((len(rx), 3, 3))
+    m[:, 0, 0] = cy * cz
+    m[:, 0, 1] = sx * sy * cz - cx * sz
+    m[:, 0, 2] = cx * sy * cz + sx * sz
+    m[:, 1, 0] = cy * sz
+    m[:, 1, 1] = sx * sy * sz + cx * cz
+    m[:, 1, 2] = cx * sy * sz - sx * cz
+    m[:, 2, 0] = -sy
+    m[:, 2, 1] = sx * cy
+    m[:, 2, 2] = cx * cy
+    return m
+
+
+def getMatrixEuler(m):
+    '''
+    return the (N,3) xyz euler rotations in degrees of (N,3,3) rotation matrices (column vectors)
+    '''
+    sy = np.clip(-m[:, 2, 0], -1.0, 1.0)
+    ry = np.arcsin(sy)
+    gimbal = np.abs(sy) > 1.0 - 1e-9
+    rx = np.where(gimbal, np.arctan2(-m[:, 1, 2], m[:, 1, 1]), np.arctan2(m[:, 2, 1], m[:, 2, 2]))
+    rz = np.where(gimbal, 0.0, np.arctan2(m[:, 1, 0], m[:, 0, 0]))
+    return np.degrees(np.stack((rx, ry, rz), axis=1))
+
+
+def getAlignRotation(upvector, normals):
+    '''
+    return the (N,3) xyz euler rotations in degrees aligning upvector on the normals, vectorized getEulerRotationQuaternion
+    '''
+    return getMatrixEuler(getQuaternionMatrix(getAlignQuaternion(upvector, normals)))
+
+
+def getCombinedRotation(rotate, relative):
+    '''
+    return the (N,3) xyz euler rotations of rotate followed by the relative rotations in object space (same as rotate -r -os), in degrees
+    '''
+    return getMatrixEuler(np.matmul(getEulerMatrix(rotate), getEulerMatrix(relative)))
+
+
+def getStrokeSpacing(positions, distance):
+    '''
+    return the indices of the positions kept along a stroke: the first one, then every position at least distance away from the previously kept one
+    '''
+    keep = [0]
+    last = positions[0]
+    for i in range(1, len(positions)):
+        if (np.linalg.norm(positions[i] - last) >= distance):
+            keep.append(i)
+            last = positions[i]
+    return np.array(keep, dtype=np.int64)
+
+
+
+#-------------------------------
+# Sampling
+#-------------------------------
+
+def sampleSurfaces(surfaces, count, rng, density=None):
+    '''
+    sample count points uniformly by area over the targetSurface list: triangles are picked from the cumulative area distribution
+    and points are placed with uniform barycentric coordinates. return the (N,) target and triangle indices and the (N,3) positions
+    density is an optional list (one entry per surface, None for uniform) of (V,) vertex weights in [0,1], averaged per triangle to scale
+    its area: hook for density masks from vertex colors or textures sampled at the vertices
+    '''
+    weights = []
+    for i, surface in enumerate(surfaces):
+        areas = surface.getAreas()
+        if (density is not None and density[i] is not None):
+            areas = areas * np.asarray(density[i], dtype=np.float64)[surface.triangles].mean(axis=1)
+        weights.append(areas)
+    offsets = np.cumsum([0] + [len(w) for w in weights])
+    cdf = np.cumsum(np.concatenate(weights)) if len(weights) else np.zeros(0)
+    if (not count or not len(cdf) or cdf[-1] <= 0.0):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, 3))
+
+    picked = np.minimum(np.searchsorted(cdf, rng.random(count) * cdf[-1], side='right'), len(cdf) - 1)
+    target = np.searchsorted(offsets, picked, side='right') - 1
+    triangle = picked - offsets[target]
+
+    r1 = np.sqrt(rng.random(count))
+    r2 = rng.random(count)
+    barycentric = np.stack((1.0 - r1, r1 * (1.0 - r2), r1 * r2), axis=1)
+    positions = np.zeros((count, 3))
+    for t in np.unique(target):
+        rows = target == t
+        positions[rows] = np.einsum('ni,nij->nj', barycentric[rows], surfaces[t].getCorners(triangle[rows]))
+    return target, triangle, positions
+
+
+def sampleRange(rng, bounds, count):
+    '''
+    return count random values uniformly picked in each (min, max) bounds, rounded like sp3dTransform: (count, len(bounds))
+    '''
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 2)
+    return np.round(rng.uniform(bounds[:, 0], bounds[:, 1], (count, len(bounds))), 3)
+
+
+def sampleRotate(settings, rng, count):
+    '''
+    return the (N,3) random rotations of the settings, vectorized sp3dTransform.getRandomRotate
+    '''
+    if (not settings.transformRotate or settings.rampFX): return np.zeros((count, 3))
+    return sampleRange(rng, settings.rotate, count)
+
+
+def sampleScale(settings, rng, count):
+    '''
+    return the (N,3) random scales of the settings, vectorized sp3dTransform.getRandomScale
+    '''
+    if (not settings.transformScale or settings.rampFX): return np.ones((count, 3))
+    if (settings.transformScaleUniform): return np.repeat(sampleRange(rng, settings.scale[:1], count), 3, axis=1)
+    return sampleRange(rng, settings.scale, count)
+
+
+def sampleOffset(settings, rng, count):
+    '''
+    return the (N,3) world offsets of the settings: up offset along world up plus the random u/v jitter
+    '''
+    up = np.asarray(settings.worldUp, dtype=np.float64)
+    offset = np.tile(up * settings.upOffset, (count, 1))
+    if (settings.jitter):
+        u = sampleRange(rng, (settings.uJitter,), count)[:, 0]
+        v = sampleRange(rng, (settings.vJitter,), count)[:, 0]
+        offset[:, 0] += u
+        offset[:, 1] += np.abs(up[1] - 1) * v
+        offset[:, 2] += np.abs(up[2] - 1) * v
+    return offset
+
+
+def getRamp(settings, count):
+    '''
+    return the (N,3) rotations and scales of the rampFX interpolation over count objects, None for the ones the rampFX mode leaves alone
+    '''
+    if (not settings.rampFX or not count): return None, None
+    ramp = (np.arange(count) + 1.0) / count
+    rotate = scale = None
+    if (settings.rampFX != 2):
+        bounds = np.asarray(settings.rotate, dtype=np.float64)
+        rotate = bounds[:, 0] + (bounds[:, 1] - bounds[:, 0]) * ramp[:, None]
+    if (settings.rampFX != 1):
+        bounds = np.asarray(settings.scale, dtype=np.float64)
+        if (settings.transformScaleUniform): bounds = np.repeat(bounds[:1], 3, axis=0)
+        scale = bounds[:, 0] + (bounds[:, 1] - bounds[:, 0]) * ramp[:, None]
+    return rotate, scale
+
+
+def getPlacements(positions, normals, source, sources, settings, rng=None, sourceTransforms=None, rotate=None, scale=None, offset=None):
+    '''
+    return the placementRecords of objects at positions (N,3) on surfaces of normals (N,3) using the sources indices (N,)
+    sourceTransforms is an optional {source: (translate, rotate, scale)}: the translate is added to the position (pivot compensation, see moveTo),
+    the rotate is kept when not aligning and the scale multiplies the sampled one
+    rotate/scale/offset are the random rotations, scales and offsets, sampled from the settings when not given (already sampled strokes)
+    '''
+    rng = rng or np.random.default_rng()
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    count = len(positions)
+    source = np.asarray(source, dtype=np.int64)
+    if (rotate is None): rotate = sampleRotate(settings, rng, count)
+    if (scale is None): scale = sampleScale(settings, rng, count)
+    if (offset is None): offset = sampleOffset(settings, rng, count)
+
+    #base transform of every object from its source
+    sourceTransforms = sourceTransforms or {}
+    baseTranslate = np.zeros((len(sources), 3))
+    baseRotate = np.zeros((len(sources), 3))
+    baseScale = np.ones((len(sources), 3))
+    for i, name in enumerate(sources):
+        if (name in sourceTransforms):
+            baseTranslate[i], baseRotate[i], baseScale[i] = sourceTransforms[name]
+
+    translate = positions + offset + baseTranslate[source]
+    if (settings.align): base = getAlignRotation(settings.worldUp, normals)
+    else: base = baseRotate[source]
+    if (np.any(rotate)): rotate = getCombinedRotation(base, rotate)
+    else: rotate = base
+    scale = baseScale[source] * scale
+
+    rampRotate, rampScale = getRamp(settings, count)
+    if (rampRotate is not None): rotate = rampRotate
+    if (rampScale is not None): scale = baseScale[source] * rampScale
+
+    return placementRecords(sources, source, translate, rotate, scale)
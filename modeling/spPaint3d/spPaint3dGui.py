@@ -18,10 +18,13 @@ import sys
 import spPaint3dContext as spPaint3dContext
 
 spPaint3dGuiID = "spPaint3d"
-spPaint3dGuiID_Height = 750
+spPaint3dGuiID_Height = 778
 spPaint3dSetupID = "spPaint3dSetup"
 spPaint3dVersion = 2011.1
 
+#window instance currently driving a tool context, released before a new window replaces it
+spPaint3dActiveWin = None
+
 #debug to log some operation down to the script editor
 sp3d_log = False
 
@@ -48,6 +51,8 @@ sp3dOptionVars = {
                     "sp3dSmoothNormal": ("iv", 1, "smoothNormal"),
                     "sp3dSetupHierarchy": ("iv", 0, "hierarchy"),
                     "sp3dGroup": ("fv", 0, "group"),
+                    "sp3dStrokeBuffer": ("iv", 0, "strokeBuffer"),
+                    "sp3dFillCount": ("fv", 1000, "fillCount"),
                     "sp3dVersion": ("fv", spPaint3dVersion, "version")
                 }
 
@@ -83,6 +88,8 @@ class sp3dToolOption (object):
         self.hierarchy = False #False = no grouping of painted objects
         self.group = 0 #float value so it doesnt get converted into boolean when I batch read the Vars / 0=single group / 1=stroke group / 2=source group
         self.groupID = None #used to track the group name where to sort the generated objects from the paint strokes
+        self.strokeBuffer = False #Paint mode only option, record the stroke and create all the objects on release
+        self.fillCount = 1000 #number of objects scattered over the targets by the fill button
         self.version = spPaint3dVersion #used to allow tracking of potentially erroneous obsolete optionVars
 
         if(self.checkVars()):
@@ -423,7 +430,9 @@ class spPaint3dWin (object):
     Main UI window class definition
     '''
     def __init__(self):
-        #delete ui window if opened
+        global spPaint3dActiveWin
+        #release the context of the window being replaced (target node callbacks), then delete ui window if opened
+        if (spPaint3dActiveWin): spPaint3dActiveWin.releaseContext()
         if mc.window(spPaint3dGuiID, exists=True): mc.deleteUI(spPaint3dGuiID)
         #removing delete prefs to prevent issues when window is spawned outside of display on mac?
         #if mc.windowPref(spPaint3dGuiID, exists=True): mc.windowPref(spPaint3dGuiID, remove=True)
@@ -510,18 +519,21 @@ class spPaint3dWin (object):
         #----------------------
         # Paint Contexts
         #----------------------
-        self.uiPaintFrame = mc.frameLayout(label='Paint', cll=True, collapseCommand=lambda:self.resizeWindow('collapse', 61), expandCommand=lambda:self.resizeWindow('expand', 61), mh=5, mw=5, borderStyle='etchedIn')
+        self.uiPaintFrame = mc.frameLayout(label='Paint', cll=True, collapseCommand=lambda:self.resizeWindow('collapse', 89), expandCommand=lambda:self.resizeWindow('expand', 89), mh=5, mw=5, borderStyle='etchedIn')
         self.uiPaintForm = mc.formLayout(numberOfDivisions=100, width=255)
         self.uiPaintDupSCB = mc.symbolCheckBox(w=52, h=18, ann='Duplicate: Instance or Copy', ofi='sp3dduplicate.xpm', oni='sp3dinstance.xpm', changeCommand=lambda * args:self.uiCheckBoxCallback("instance", args))
         self.uiPaintRandSCB = mc.symbolCheckBox(w=52, h=18, ann='Object distribution: Random or Sequential', ofi='sp3dsequence.xpm', oni='sp3drandom.xpm', changeCommand=lambda * args:self.uiCheckBoxCallback("random", args))
         self.uiPaintAlignSCB = mc.symbolCheckBox(w=100, h=18, ann='Align generated objects to the target surface', ofi='sp3dalignoff.xpm', oni='sp3dalign.xpm', changeCommand=lambda * args:self.uiCheckBoxCallback("align", args))
         self.uiPaintCtxBtn = mc.symbolButton(w=105, h=28, ann='Paint', image='sp3dpaint.xpm', command=lambda * args:self.genericContextCallback("PaintCtx"))
         self.uiPlaceCtxBtn = mc.symbolButton(w=105, h=28, ann='Place', image='sp3dplace.xpm', command=lambda * args:self.genericContextCallback("PlaceCtx"))
+        self.uiFillCount = mc.intFieldGrp(label='Fill count', w=105, cw=[(1, 50), (2, 50)], changeCommand=lambda * args:self.uiFillCountCallback("fillCount", args))
+        self.uiFillBtn = mc.button(label='Fill', w=105, h=22, ann='Scatter the fill count of objects over the target surfaces, uniformly by area', command=lambda * args:self.genericContextCallback("Fill"))
         
         mc.formLayout(self.uiPaintForm, edit=True,
                         attachForm=[(self.uiPaintDupSCB, 'top', 0)],
                         attachControl=[    (self.uiPaintRandSCB, 'left', 5, self.uiPaintDupSCB), (self.uiPaintAlignSCB, 'left', 5, self.uiPaintRandSCB),
-                                         (self.uiPaintCtxBtn, 'top', 5, self.uiPaintDupSCB), (self.uiPlaceCtxBtn, 'top', 5, self.uiPaintDupSCB), (self.uiPlaceCtxBtn, 'left', 5, self.uiPaintCtxBtn)])
+                                         (self.uiPaintCtxBtn, 'top', 5, self.uiPaintDupSCB), (self.uiPlaceCtxBtn, 'top', 5, self.uiPaintDupSCB), (self.uiPlaceCtxBtn, 'left', 5, self.uiPaintCtxBtn),
+                                         (self.uiFillCount, 'top', 5, self.uiPaintCtxBtn), (self.uiFillBtn, 'top', 5, self.uiPaintCtxBtn), (self.uiFillBtn, 'left', 5, self.uiFillCount)])
         
         mc.setParent(self.uiTopColumn)
         
@@ -582,6 +594,9 @@ class spPaint3dWin (object):
         # Context tracking
         #----------------------
         self.ctx = None
+        spPaint3dActiveWin = self
+        #closing or deleting the window drops the context along with it
+        mc.scriptJob(uiDeleted=[self.uiWin, self.releaseContext], runOnce=True)
         
         mc.showWindow(self.uiWin)
         self.resizeWindow('winui', spPaint3dGuiID_Height) # force a resize to prevent some weird UI issue on mac
@@ -637,6 +652,15 @@ class spPaint3dWin (object):
         self.updateCtx()
 
 
+    def uiFillCountCallback(self, *args):
+        '''
+        Callback for fill count field change
+        INPUT: [variable name, (value to update,)]
+        '''
+        self.uiValues.__dict__[args[0]] = float(max(0, int(args[1][0])))
+        self.uiValues.commitVars()
+
+
     def uiPaintOffsetCallback(self, *args):
         '''
         Callback for paint Offset field change
@@ -680,6 +704,7 @@ class spPaint3dWin (object):
         mc.symbolCheckBox(self.uiPaintDupSCB, edit=True, value=ui.instance)
         mc.symbolCheckBox(self.uiPaintRandSCB, edit=True, value=ui.random)
         mc.symbolCheckBox(self.uiPaintAlignSCB, edit=True, value=ui.align)
+        mc.intFieldGrp(self.uiFillCount, edit=True, v1=int(ui.fillCount))
 
         # toggling the proper paint flux control
         mc.floatSliderGrp(self.uiPaintTimer, edit=True, visible=(not ui.paintFlux), value=ui.paintTimer)
@@ -730,6 +755,17 @@ class spPaint3dWin (object):
             self.ctx.runtimeUpdate(self.uiValues, self.transform, self.sourceList, self.targetList)
 
 
+    def releaseContext(self, *args):
+        '''
+        drop the running context: release its cached target state (node callbacks) and remove its tool, it can't be driven without the window
+        '''
+        if (self.ctx):
+            self.ctx.release()
+            self.ctx = None
+            if (mc.currentCtx() == spPaint3dContext.spPaint3dContextID): mc.setToolTo('selectSuperContext')
+            if (mc.draggerContext(spPaint3dContext.spPaint3dContextID, exists=True)): mc.deleteUI(spPaint3dContext.spPaint3dContextID)
+
+
     def uiListCallback(self, *args):
         '''
         textScrollList callback to manage the addition/removal/reset of the source & target object lists
@@ -801,6 +837,9 @@ class spPaint3dWin (object):
         else:
             #if we reach here, then there seem to be no errors caught
             #call the appropriate context and set self attributes
+            if (self.ctx and args[0] in ('PaintCtx', 'PlaceCtx')):
+                #dropping the previous context, releasing its cached target state
+                self.ctx.release()
             if (args[0] == 'PaintCtx'):
                 #creating (or overwritring with) a paint context
                 self.errorHandle.raiseError("Engage!! Maximum Paint...")
@@ -811,6 +850,10 @@ class spPaint3dWin (object):
                 self.errorHandle.raiseError("Engage!! Maximum Place...")
                 self.ctx = spPaint3dContext.placeContext(self.uiValues, self.transform, self.sourceList, self.targetList)
                 self.ctx.runContext()
+            elif (args[0] == 'Fill'):
+                #one shot scatter over the whole targets, no context involved
+                created = spPaint3dContext.fillTargets(self.targetList, self.sourceList, self.uiValues, self.transform, self.uiValues.fillCount)
+                self.errorHandle.raiseError("Filled the targets with %i objects" % len(created))
 
 
     def setupWin(self, uiOptions):
@@ -896,6 +939,17 @@ class spPaint3dWin (object):
 
         mc.setParent(self.uiSetupTopColumn)
 
+        #----------------------
+        # Stroke Options
+        #----------------------
+        self.uiSetupStrokeFrame = mc.frameLayout(label='Paint Stroke Options', borderStyle='etchedIn', marginHeight=5, marginWidth=20)
+        self.uiSetupStrokeForm = mc.formLayout(numberOfDivisions=100)
+        self.uiSetupStrokeBuffer = mc.checkBoxGrp(label='Create objects on release', changeCommand=lambda * args:self.setupCallback('uiSetupStrokeBuffer', args), numberOfCheckBoxes=1)
+
+        mc.formLayout(self.uiSetupStrokeForm, edit=True, attachForm=[(self.uiSetupStrokeBuffer, 'top', 0)])
+
+        mc.setParent(self.uiSetupTopColumn)
+
         #----------------------
         # Dev feature
         #----------------------
@@ -929,6 +983,7 @@ class spPaint3dWin (object):
 
         mc.floatFieldGrp(self.uiSetupPlaceRotate, edit=True, visible=True, v1=ui.placeRotate)
         mc.checkBoxGrp(self.uiSetupContinuousTransform, edit=True, value1=ui.continuousTransform)
+        mc.checkBoxGrp(self.uiSetupStrokeBuffer, edit=True, value1=ui.strokeBuffer)
 
 
         # toggling the proper hierarchy grouping options
@@ -1030,6 +1085,8 @@ class spPaint3dWin (object):
             self.uiValues.group = 2.0
         elif(radiocol == 'uiSetupContinuousTransform'):
             self.uiValues.continuousTransform = getBoolFromMayaControl(args[1][0], self.mayaVersion)
+        elif(radiocol == 'uiSetupStrokeBuffer'):
+            self.uiValues.strokeBuffer = getBoolFromMayaControl(args[1][0], self.mayaVersion)
         else:
             print(args)
 
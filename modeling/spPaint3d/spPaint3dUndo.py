@@ -0,0 +1,81 @@
+#-----------------------------------------------------------------
+#    SCRIPT            spPaint3dUndo.py
+#
+#    DESCRIPTION:    Minimal python plugin registering the spPaint3dModifier
+#                    command, which runs a prepared om2.MDGModifier as a single
+#                    undoable command. Lets the contexts set thousands of plug
+#                    values through the API in one go while keeping them in the
+#                    undo queue. Loaded on demand by doModifier.
+#
+#-----------------------------------------------------------------
+
+import os
+import sys
+import types
+
+import maya.cmds as mc
+import maya.api.OpenMaya as om2
+
+sp3dModifierCommand = "spPaint3dModifier"
+
+#maya imports the plugin file as its own module, the modifiers waiting to be run are shared through a module both copies can find
+sp3dPending = sys.modules.setdefault('spPaint3dUndoPending', types.ModuleType('spPaint3dUndoPending'))
+if (not hasattr(sp3dPending, 'modifiers')): sp3dPending.modifiers = []
+
+
+
+def maya_useNewAPI():
+    '''
+    the plugin uses the python API 2.0
+    '''
+    pass
+
+
+
+class modifierCommand (om2.MPxCommand):
+    '''
+    run the pending modifier, undo and redo it along with the maya undo queue
+    '''
+    def __init__(self):
+        om2.MPxCommand.__init__(self)
+        self.modifier = None
+
+    def doIt(self, args):
+        self.modifier = sp3dPending.modifiers.pop()
+        self.modifier.doIt()
+
+    def undoIt(self):
+        self.modifier.undoIt()
+
+    def redoIt(self):
+        self.modifier.doIt()
+
+    def isUndoable(self):
+        return True
+
+    @staticmethod
+    def creator():
+        return modifierCommand()
+
+
+
+def initializePlugin(plugin):
+    om2.MFnPlugin(plugin, 'Sebastien Paviot').registerCommand(sp3dModifierCommand, modifierCommand.creator)
+
+
+def uninitializePlugin(plugin):
+    om2.MFnPlugin(plugin).deregisterCommand(sp3dModifierCommand)
+
+
+
+def doModifier(modifier):
+    '''
+    run the om2.MDGModifier modifier as one undoable spPaint3dModifier command, loading the plugin first if needed
+    '''
+    if (not mc.pluginInfo('spPaint3dUndo', query=True, loaded=True)):
+        mc.loadPlugin(os.path.splitext(os.path.abspath(__file__))[0] + '.py', quiet=True)
+    sp3dPending.modifiers.append(modifier)
+    try:
+        getattr(mc, sp3dModifierCommand)()
+    finally:
+        if (modifier in sp3dPending.modifiers): sp3dPending.modifiers.remove(modifier)
@@ -4,7 +4,7 @@
 # Only tested on Windows with Python3, Arnold as target dcc. May need to tweak some options if using prman for example.
 # You can add this to PATH to call it from command line, or to a .bashrc like so:
 # txconvert() {
-#    python path_to_txconvert.py $1 $2 $3 $4
+#    python path_to_txconvert.py "$@"
 #}
 
 import subprocess
@@ -12,101 +12,1315 @@ import argparse
 import os
 from concurrent import futures
 import sys
+import json
+import time
+import hashlib
+import threading
+import heapq
+import fnmatch
+import struct
+import re
+import csv
+import collections
+import socket
+import shutil
+from contextlib import contextmanager
 
-# Run maketx
-def run_maketx(filename, verbose):
-    cmd = "maketx " # This can be modified to a direct binary, otherwise maketx directory needs to be in PATH
-    cmd += '"' + filename + '"'
-    ocio = os.environ['OCIO'] #Can be manually remapped to a .ocio file
-    cmd += ' --colorconfig ' + ocio
+MANIFEST_NAME = '.txconvert_manifest.json'
+JOURNAL_NAME = '.txconvert_journal.jsonl'
+MANIFEST_VERSION = 1
+MANIFEST_SAVE_INTERVAL = 50 # Flush the manifest every N conversions so an interrupted run keeps its progress
+LOCK_TIMEOUT = 30.0
+LOCK_STALE = 120.0 # A lock file older than this is assumed to belong to a dead process
+DEFAULT_THREADS_PER_JOB = 4 # maketx scales well up to a handful of threads, past that more processes win
+SCHEDULE_LOOKAHEAD = 256 # Found-but-waiting jobs held back for largest-first ordering while the walk continues
+PROGRESS_INTERVAL = 2.0
+JOB_LOG_LINES = 500 # Lines of maketx output buffered per job
+LOG_TAIL = 10 # Lines of that buffer kept in the report
+REPORT_FIELDS = ('source', 'output', 'action', 'exit_code', 'wall_seconds', 'cpu_seconds', 'input_bytes', 'output_bytes', 'log_tail')
+PRINT_LOCK = threading.Lock()
+REPORT_SLOWEST = 10
+VALID_FORMATS = ('png', 'jpg', 'jpeg', 'tif', 'tiff', 'exr', 'dds', 'tga', 'bmp', 'psd')
+
+
+# Output path maketx writes for a source texture
+def get_output_path(filename):
+    return os.path.splitext(filename)[0] + '.tx'
+
+
+### ###################### ###
+### TEXTURE CLASSIFICATION ###
+### ###################### ###
+
+# Colorspace, bit depth and compression are picked per file by a table of rules matched against filename tokens.
+# The table can be replaced with a JSON (or YAML, if PyYAML is installed) profile with the same layout as
+# DEFAULT_PROFILE. Presets only list what differs from DEFAULT_PRESET. When several rules match a file,
+# the highest priority wins, so displacement maps named like "height_color" stay raw float data.
+
+DEFAULT_PRESET = {
+    'colorspace': 'Utility - Raw',
+    'target_colorspace': 'ACES - ACEScg',
+    'format': 'exr',
+    'depth': 'half',
+    'compression': 'dwaa',
+}
+
+DEFAULT_PROFILE = {
+    'default': 'raw',
+    'presets': {
+        'raw': {},
+        'color': {'colorspace': 'Utility - sRGB - Texture'},
+        'displacement': {'depth': 'float', 'compression': 'zip'},
+    },
+    'rules': [
+        {'name': 'displacement', 'tokens': ['dsp', 'disp', 'displacement', 'zdisp', 'height'], 'preset': 'displacement', 'priority': 20},
+        {'name': 'color', 'tokens': ['srgb', 'basecolor', 'albedo', 'color', 'diffuse'], 'preset': 'color', 'priority': 10},
+    ],
+}
+
+
+# Read a classification profile from disk
+def load_profile(path):
+    with open(path, 'r') as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError('PyYAML is needed to read {}, use a JSON profile instead'.format(path))
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+# Build a prefix-trie regex from literal tokens, e.g. disp/dsp/displacement -> d(?:isp(?:lacement)?|sp)
+# Python's re tries alternatives one by one, a trie lets it reject most positions after one character.
+def get_trie_pattern(tokens):
+    trie = {}
+    for token in tokens:
+        node = trie
+        for char in token:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def emit(node):
+        end = '' in node
+        alternatives = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ''
+        body = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+        return '(?:' + body + ')?' if end else body # Greedy optional tail, so the longest token wins
+
+    return emit(trie)
+
+
+# Compiled rule table. Rules are grouped by priority and every level becomes one optional lookahead around
+# a trie of that level's tokens, so a single match() call against the lowercased file name fills in the
+# first token found at each level. The highest level with a hit decides the preset.
+class TextureClassifier(object):
+    def __init__(self, profile=None):
+        profile = profile or DEFAULT_PROFILE
+        self.presets = {}
+        for name, values in profile['presets'].items():
+            self.presets[name] = dict(DEFAULT_PRESET, **values)
+        self.default = profile.get('default', 'raw')
+        if self.default not in self.presets:
+            self.presets[self.default] = dict(DEFAULT_PRESET)
+
+        levels = {}
+        for rule in profile.get('rules', []):
+            if rule['preset'] not in self.presets:
+                raise ValueError('Rule {0} uses unknown preset {1}'.format(rule.get('name'), rule['preset']))
+            levels.setdefault(rule.get('priority', 0), []).append(rule)
+
+        # Per level: regex group index, literal token -> rule lookup and any raw regex patterns
+        self.levels = []
+        lookaheads = []
+        group = 1
+        for priority in sorted(levels, reverse=True):
+            tokens = {}
+            patterns = []
+            for rule in levels[priority]:
+                for token in rule.get('tokens', []):
+                    tokens.setdefault(token.lower(), rule)
+                for pattern in rule.get('patterns', []):
+                    patterns.append((re.compile(pattern), rule, pattern))
+            alternatives = [get_trie_pattern(tokens)] if tokens else []
+            alternatives += ['(?:' + pattern.pattern + ')' for pattern, rule, _ in patterns]
+            lookaheads.append('(?=.*?(' + '|'.join(alternatives) + '))?')
+            self.levels.append((group, tokens, patterns))
+            group += 1 + sum(pattern.groups for pattern, rule, _ in patterns)
+        self.regex = re.compile(''.join(lookaheads)) if lookaheads else None
+
+    # Return (preset name, preset, matched rule, matched token) for a file
+    def classify(self, filename):
+        if self.regex:
+            match = self.regex.match(os.path.basename(filename).lower())
+            for group, tokens, patterns in self.levels:
+                text = match.group(group)
+                if text is None:
+                    continue
+                rule = tokens.get(text)
+                if rule:
+                    return rule['preset'], self.presets[rule['preset']], rule, text
+                for pattern, rule, source in patterns:
+                    if pattern.fullmatch(text):
+                        return rule['preset'], self.presets[rule['preset']], rule, source
+        return self.default, self.presets[self.default], None, None
+
+    def get_preset(self, filename):
+        return self.classify(filename)[1]
+
+    def explain(self, filename):
+        name, preset, rule, token = self.classify(filename)
+        if rule:
+            why = "rule '{0}' (token '{1}', priority {2})".format(rule.get('name', name), token, rule.get('priority', 0))
+        else:
+            why = 'no rule matched, default'
+        return "{0}\n    {1} -> preset '{2}': {3} -> {4}, {5} {6}/{7}".format(
+            filename, why, name, preset['colorspace'], preset['target_colorspace'],
+            preset['format'], preset['depth'], preset['compression'])
+
+
+# Build the maketx argument list for a preset (everything except the binary, input and output paths)
+def get_maketx_options(preset, ocio, colorconvert=True):
+    args = ['--colorconfig', ocio]
 
     # Note that lanczos3 is used for filtering for quality, but is a bit slower - can be modified
-    cmd += ' --opaque-detect --constant-color-detect --monochrome-detect --fixnan box3 -u --filter lanczos3 --threads 12 --attrib tiff:half 1 -v --unpremult --oiio --colorconvert '
-    
-    # These tags are used to determine certain settings that can be modified
-    color_tags = ('srgb', 'basecolor', 'albedo', 'color', 'diffuse')
-    disp_tags = ('dsp', 'disp', 'displacement', 'zdisp', 'height')
-    color_tag_found = any(tag in filename.lower() for tag in color_tags)
-    dsp_tag_found = any(tag in filename.lower() for tag in disp_tags)
-
-    if dsp_tag_found: color_tag_found==False
-
-    if color_tag_found:
-        cmd += ' "Utility - sRGB - Texture" '
-    else:
-        cmd += ' "Utility - Raw" '
-    cmd += '"ACES - ACEScg" --format exr '
+    args += ['--opaque-detect', '--constant-color-detect', '--monochrome-detect', '--fixnan', 'box3', '-u',
+             '--filter', 'lanczos3', '--attrib', 'tiff:half', '1', '-v', '--unpremult', '--oiio']
+    if colorconvert:
+        args += ['--colorconvert', preset['colorspace'], preset['target_colorspace']]
+    args += ['--format', preset['format']]
+    args += ['-d', preset['depth'], '--compression', preset['compression']]
+    return args
 
-    if dsp_tag_found:
-        cmd += '-d float --compression zip '
-    else:
-        cmd += '-d half --compression dwaa '
-    
-    if not verbose:
-        subprocess.run(cmd, stdout=subprocess.DEVNULL)
+
+# Find the maketx binary once per run: explicit path, then $MAKETX, then PATH
+def resolve_maketx(path=None):
+    path = path or os.environ.get('MAKETX') or shutil.which('maketx')
+    if not path:
+        raise RuntimeError('maketx not found, add its directory to PATH or pass --maketx')
+    path = os.path.abspath(path)
+    if not os.path.isfile(path) or not os.access(path, os.X_OK):
+        raise RuntimeError('maketx is not an executable file: {}'.format(path))
+    return path
+
+
+# Find the OCIO config once per run: explicit path, then $OCIO
+def resolve_ocio(path=None):
+    path = path or os.environ.get('OCIO')
+    if not path:
+        raise RuntimeError('No OCIO config, set $OCIO or pass --ocio')
+    path = os.path.abspath(path)
+    if not os.path.isfile(path):
+        raise RuntimeError('OCIO config not found: {}'.format(path))
+    return path
+
+
+### ############# ###
+### IMAGE PROBING ###
+### ############# ###
+
+# Header-only EXR/TIFF inspection, enough to tell whether maketx has anything left to do with a file.
+# Only the first PROBE_SIZE bytes of an EXR are read; TIFF needs a few small seeks to count its IFDs (mip levels).
+
+PROBE_SIZE = 65536
+COMPLIANT = 'already compliant'
+RETILE = 'needs retile'
+FULL_CONVERT = 'needs full convert'
+
+EXR_MAGIC = b'\x76\x2f\x31\x01'
+EXR_PIXEL_TYPES = {0: 'uint', 1: 'half', 2: 'float'}
+EXR_COMPRESSION = {0: 'none', 1: 'rle', 2: 'zips', 3: 'zip', 4: 'piz', 5: 'pxr24', 6: 'b44', 7: 'b44a', 8: 'dwaa', 9: 'dwab'}
+TIFF_COMPRESSION = {1: 'none', 5: 'lzw', 8: 'zip', 32946: 'zip', 32773: 'packbits'}
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+TIFF_PER_SAMPLE_TAGS = (258, 339) # BitsPerSample, SampleFormat: one value per channel, out of line for RGB/RGBA
+# Source colorspaces holding plain data, converting them to the target is a no-op
+RAW_COLORSPACES = ('utility - raw', 'raw', 'data', 'non-color')
+
+
+# Parse an OpenEXR header, returns None if the file isn't a readable single-part EXR
+def probe_exr(f):
+    data = f.read(PROBE_SIZE)
+    if len(data) < 8 or data[:4] != EXR_MAGIC:
+        return None
+    flags = struct.unpack_from('<I', data, 4)[0]
+    if flags & 0x1800: # Multipart or deep data, leave those to maketx
+        return None
+    info = {'format': 'exr', 'tiled': bool(flags & 0x200), 'mipmapped': False, 'pixel_types': set(), 'compression': None}
+
+    pos = 8
+    try:
+        while data[pos] != 0:
+            name_end = data.index(b'\0', pos)
+            name = data[pos:name_end]
+            type_end = data.index(b'\0', name_end + 1)
+            size = struct.unpack_from('<i', data, type_end + 1)[0]
+            value = data[type_end + 5:type_end + 5 + size]
+            if len(value) < size:
+                return None # Header runs past the probe window
+            pos = type_end + 5 + size
+
+            if name == b'channels':
+                c = 0
+                while value[c] != 0:
+                    c = value.index(b'\0', c) + 1
+                    info['pixel_types'].add(EXR_PIXEL_TYPES.get(struct.unpack_from('<i', value, c)[0]))
+                    c += 16
+            elif name == b'compression':
+                info['compression'] = EXR_COMPRESSION.get(value[0])
+            elif name == b'tiles':
+                info['mipmapped'] = (value[8] & 0x0f) == 1 # MIPMAP_LEVELS
+    except (IndexError, ValueError, struct.error):
+        return None
+    return info
+
+
+# Parse a classic TIFF's IFD chain, returns None if the file isn't a readable TIFF
+def probe_tiff(f):
+    head = f.read(8)
+    if head[:4] == b'II*\0':
+        endian = '<'
+    elif head[:4] == b'MM\0*':
+        endian = '>'
     else:
-        subprocess.run(cmd, shell=True)
-    return "Converted {} ...".format(filename)
+        return None # Not a TIFF, or a BigTIFF
+
+    info = {'format': 'tiff', 'tiled': False, 'mipmapped': False, 'pixel_types': set(), 'compression': None}
+    offset = struct.unpack(endian + 'I', head[4:8])[0]
+    levels = 0
+    try:
+        while offset and levels < 32:
+            f.seek(offset)
+            count = struct.unpack(endian + 'H', f.read(2))[0]
+            entries = f.read(count * 12 + 4)
+            tags = {}
+            for i in range(count):
+                tag, kind, n = struct.unpack_from(endian + 'HHI', entries, i * 12)
+                fmt = 'H' if kind == 3 else 'I'
+                if TIFF_TYPE_SIZES.get(kind, 4) * n <= 4:
+                    tags[tag] = struct.unpack_from(endian + fmt, entries, i * 12 + 8)[0]
+                elif levels == 0 and tag in TIFF_PER_SAMPLE_TAGS and kind in (3, 4):
+                    # Per channel values stored out of line, any channel differing makes it a mixed layout
+                    f.seek(struct.unpack_from(endian + 'I', entries, i * 12 + 8)[0])
+                    values = set(struct.unpack(endian + fmt * n, f.read(struct.calcsize(fmt) * n)))
+                    tags[tag] = values.pop() if len(values) == 1 else None
+            if levels == 0:
+                info['tiled'] = 322 in tags # TileWidth
+                info['compression'] = TIFF_COMPRESSION.get(tags.get(259, 1))
+                bits = tags.get(258, 8)
+                float_data = tags.get(339, 1) == 3
+                info['pixel_types'].add({16: 'half', 32: 'float'}.get(bits) if float_data else 'uint')
+            levels += 1
+            offset = struct.unpack_from(endian + 'I', entries, count * 12)[0]
+    except struct.error:
+        return None
+    info['mipmapped'] = levels > 1
+    return info
+
+
+# Read just enough of a file to describe its layout, returns None for anything that can't be probed
+def probe_image(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    try:
+        with open(filename, 'rb') as f:
+            if ext == '.exr':
+                return probe_exr(f)
+            if ext in ('.tif', '.tiff'):
+                return probe_tiff(f)
+    except OSError:
+        pass
+    return None
+
+
+# Compare a probed header against the preset maketx would use
+# Compliant: already a tiled, mipmapped EXR with the target depth and compression, nothing to do.
+# Retile: pixel data is already in the target float depth, so only tiling/mips/compression need redoing.
+# Both need the preset's colorspace to already be the target one (or plain data), anything that needs a
+# colorspace conversion, or anything the probe couldn't read, goes through the full conversion.
+def classify_image(info, preset):
+    if needs_colorconvert(preset):
+        return FULL_CONVERT
+    if not info or info['pixel_types'] != {preset['depth']}:
+        return FULL_CONVERT
+    if (info['format'] == preset['format'] and info['tiled'] and info['mipmapped']
+            and info['compression'] == preset['compression']):
+        return COMPLIANT
+    return RETILE
+
+
+# Whether the preset's colorspace conversion actually changes pixel values
+def needs_colorconvert(preset):
+    source = preset['colorspace'].lower()
+    return source != preset['target_colorspace'].lower() and source not in RAW_COLORSPACES
+
+
+# Put a compliant source in place as the output without rewriting it, hardlinked where possible
+def link_output(filename, output):
+    if os.path.exists(output) and os.path.samefile(filename, output):
+        return # Already linked by an earlier run, replacing a file with itself would leave the temp behind
+    temp_output = get_temp_output_path(output)
+    try:
+        os.link(filename, temp_output)
+    except OSError:
+        shutil.copy2(filename, temp_output)
+    os.replace(temp_output, output)
+    if os.path.exists(temp_output):
+        os.remove(temp_output)
+
+
+# Split the machine's cores into concurrent maketx processes and threads per process
+# Either value can be overridden, the other one is derived from the core count
+def get_worker_budget(jobs=None, threads_per_job=None):
+    cores = os.cpu_count() or 1
+    if jobs and not threads_per_job:
+        threads_per_job = max(1, cores // jobs)
+    elif threads_per_job and not jobs:
+        jobs = max(1, cores // threads_per_job)
+    elif not jobs and not threads_per_job:
+        threads_per_job = min(DEFAULT_THREADS_PER_JOB, cores)
+        jobs = max(1, cores // threads_per_job)
+    return jobs, threads_per_job
+
+
+# Temporary path maketx writes to before the finished output is renamed into place
+def get_temp_output_path(output):
+    return '{0}.partial-{1}-{2}.tx'.format(os.path.splitext(output)[0], os.getpid(), threading.get_ident())
+
+
+# Wait for a child process and return (exit code, CPU seconds used by it and its waited-for children)
+# os.wait4 only exists on POSIX, elsewhere CPU time isn't available and None is returned instead
+def wait_child(proc):
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        return proc.returncode, round(usage.ru_utime + usage.ru_stime, 4)
+    return proc.wait(), None
+
+
+# Run maketx
+# maketx is started straight from an argument list, without a shell. Its combined output is read line by
+# line into a per-job log buffer, printed as one block in verbose mode so parallel jobs don't interleave.
+# The output is written to a temporary file and only renamed over the real output once maketx succeeded,
+# so a killed run can never leave a half-written texture behind under the final name.
+# Returns (success, message, details) where details holds the exit code, child CPU time and log tail.
+def run_maketx(maketx, filename, options, verbose, threads=DEFAULT_THREADS_PER_JOB, temp_output=None):
+    output = get_output_path(filename)
+    temp_output = temp_output or get_temp_output_path(output)
+    argv = [maketx, filename] + options + ['--threads', str(threads), '-o', temp_output]
+
+    try:
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        log = collections.deque(maxlen=JOB_LOG_LINES)
+        for line in proc.stdout:
+            log.append(line.decode(errors='replace').rstrip())
+        proc.stdout.close()
+        exit_code, cpu_seconds = wait_child(proc)
+        details = {'exit_code': exit_code, 'cpu_seconds': cpu_seconds, 'log_tail': '\n'.join(list(log)[-LOG_TAIL:])}
+        if verbose:
+            with PRINT_LOCK:
+                print('\n'.join(['[maketx] ' + filename] + list(log)), flush=True)
+
+        if exit_code == 0 and os.path.isfile(temp_output) and os.path.getsize(temp_output) > 0:
+            os.replace(temp_output, output)
+            return True, "Converted {} ...".format(filename), details
+        return False, "Failed to convert {0} (maketx exit code {1}) ...".format(filename, exit_code), details
+    finally:
+        if os.path.exists(temp_output):
+            os.remove(temp_output)
+
+
+# Hash file contents in chunks so large textures never have to sit in memory
+def get_file_hash(filename, chunk_size=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Whether the process recorded as host:pid is still running. Holders on other hosts, or on platforms where
+# signalling a pid isn't a harmless probe, are assumed to be alive; an empty holder is still writing its lock.
+def process_alive(holder):
+    host, _, pid = holder.rpartition(':')
+    if os.name != 'posix' or host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass # Exists but belongs to someone else
+    return True
+
+
+# Size of a file that may have been removed meanwhile, None when it can't be read
+def get_file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return None
+
+
+# Cross-process lock using an exclusively created lock file next to the target
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT, stale=LOCK_STALE):
+    lock_path = path + '.lock'
+    start = time.time()
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            break
+        except FileExistsError:
+            # Break locks left behind by killed processes
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.time() - start > timeout:
+                raise RuntimeError('Timed out waiting for lock {}'.format(lock_path))
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+
+# Identity of a written output, as stored by the manifest and the journal
+def get_output_record(output):
+    try:
+        st = os.stat(output)
+    except OSError:
+        return None
+    return {'output': output, 'output_size': st.st_size, 'output_mtime': st.st_mtime_ns}
+
+
+# Check that a recorded output still exists and is the file that was written
+def output_valid(entry):
+    output = entry.get('output')
+    if not output:
+        return False
+    try:
+        st = os.stat(output)
+    except OSError:
+        return False
+    return st.st_size > 0 and st.st_size == entry.get('output_size') and st.st_mtime_ns == entry.get('output_mtime')
+
+
+# Persistent record of previous conversions, used to skip textures that haven't changed
+# Entries are keyed on absolute source path and store the source identity (size, mtime, optional hash),
+# a digest of the full maketx option string and the identity of the output that was written.
+# Several txconvert processes can share one manifest: writes are merged under a lock and atomically replaced.
+class ConversionManifest(object):
+    def __init__(self, path, use_hash=False):
+        self.path = path
+        self.use_hash = use_hash
+        self.entries = {}
+        self.updates = {}
+        self.removed = set()
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    def read(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != MANIFEST_VERSION:
+            return {}
+        return data.get('entries', {})
+
+    def load(self):
+        self.entries = self.read()
+        return self
+
+    # Build the cache key for a source file and its resolved maketx options
+    def get_key(self, filename, options, st=None):
+        st = st or os.stat(filename)
+        key = {
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'options': hashlib.sha1('\0'.join(options).encode()).hexdigest(),
+            'hash': None,
+        }
+        if self.use_hash:
+            # Reuse the stored hash when size and mtime haven't moved, the file can't have changed
+            entry = self.entries.get(filename)
+            if entry and entry.get('hash') and entry['size'] == key['size'] and entry['mtime'] == key['mtime']:
+                key['hash'] = entry['hash']
+            else:
+                key['hash'] = get_file_hash(filename)
+        return key
+
+    def is_current(self, filename, key):
+        entry = self.entries.get(filename)
+        if not entry or entry.get('options') != key['options']:
+            return False
+        if key['hash']:
+            # Content hash makes a touched-but-identical file still count as unchanged
+            same_source = entry.get('hash') == key['hash'] and entry.get('size') == key['size']
+        else:
+            same_source = entry.get('size') == key['size'] and entry.get('mtime') == key['mtime']
+        return same_source and output_valid(entry)
+
+    def record(self, filename, key, output):
+        entry = get_output_record(output)
+        if not entry:
+            return
+        entry.update(key)
+        with self._lock:
+            self.entries[filename] = entry
+            self.updates[filename] = entry
+            self.removed.discard(filename)
+            self.pending += 1
+            flush = self.pending >= MANIFEST_SAVE_INTERVAL
+        if flush:
+            self.save()
+
+    # Drop entries whose source or output no longer exists
+    def prune(self):
+        stale = [f for f, e in self.entries.items() if not os.path.isfile(f) or not output_valid(e)]
+        with self._lock:
+            for f in stale:
+                self.entries.pop(f, None)
+                self.updates.pop(f, None)
+                self.removed.add(f)
+        return len(stale)
+
+    # Merge our changes into whatever is on disk now, then atomically replace the manifest
+    def save(self):
+        with self._lock:
+            updates = dict(self.updates)
+            removed = set(self.removed)
+            self.updates.clear()
+            self.removed.clear()
+            self.pending = 0
+        if not updates and not removed:
+            return
+        with file_lock(self.path):
+            entries = self.read()
+            for f in removed:
+                entries.pop(f, None)
+            entries.update(updates)
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': MANIFEST_VERSION, 'entries': entries}, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+# Append-only log of the current batch, fsynced per record so it survives a killed process
+# Every job writes a "start" record before maketx runs and a "done" or "failed" record after.
+# On --resume, sources whose last record is "done" with an intact output are skipped, everything else
+# (including jobs that were running when the batch died) is requeued and their partial outputs removed.
+class BatchJournal(object):
+    def __init__(self, path):
+        self.path = path
+        self.finished = {}
+        self.handle = None
+        self.lock_path = None
+        self._lock = threading.Lock()
+
+    # One batch per journal: a second run would truncate it or interleave its records, so a held journal is refused.
+    # The lock file names its holder (host:pid) and is taken over when that process is gone.
+    def acquire(self):
+        lock_path = self.path + '.lock'
+        holder = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    with open(lock_path, 'r') as f:
+                        other = f.read().strip()
+                except OSError:
+                    continue # Released meanwhile
+                if not process_alive(other):
+                    try:
+                        os.remove(lock_path)
+                    except OSError:
+                        pass
+                    continue
+                raise RuntimeError('Journal {0} is in use by another batch ({1}). Wait for it to finish, give this run its own --journal, '
+                                   'or remove {2} if that batch is no longer running.'.format(self.path, other or 'starting', lock_path))
+            os.write(fd, holder.encode())
+            os.close(fd)
+            self.lock_path = lock_path
+            return
+
+    def read(self):
+        last = {}
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # Torn last line from a killed process
+                    last[record['source']] = record
+        except OSError:
+            pass
+        return last
+
+    # Load finished jobs and clean up after unfinished ones, returns the number of requeued jobs
+    # A journal without a path records nothing, the work queue keeps track of jobs in distributed mode
+    def open(self, resume):
+        requeued = 0
+        if not self.path:
+            return requeued
+        self.acquire()
+        if resume:
+            for source, record in self.read().items():
+                if record['event'] == 'done' and output_valid(record):
+                    self.finished[source] = record
+                    continue
+                requeued += 1
+                temp_output = record.get('temp_output')
+                if temp_output and os.path.exists(temp_output):
+                    os.remove(temp_output)
+        self.handle = open(self.path, 'a' if resume else 'w')
+        return requeued
+
+    def is_finished(self, source):
+        return source in self.finished
+
+    def write(self, event, source, **fields):
+        record = {'event': event, 'source': source, 'time': time.time(), 'pid': os.getpid()}
+        record.update(fields)
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if not self.handle:
+                return
+            self.handle.write(line)
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+
+    def close(self):
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+        if self.lock_path:
+            try:
+                os.remove(self.lock_path)
+            except OSError:
+                pass
+            self.lock_path = None
+
+
+# Groups byte-identical sources that would get the same maketx options, so only one of each group is converted
+# Candidates are bucketed on size and option digest as they stream in; contents are only hashed once a bucket
+# holds more than one file. Duplicates of a representative that is still converting wait in its sibling list.
+class DedupeIndex(object):
+    def __init__(self):
+        self.buckets = {}
+        self.hashes = {}
+        self.siblings = {}
+        self.finished = {} # Representative -> CPU (or wall, if unavailable) seconds its conversion took, None if it failed
+        self.saved_files = 0
+        self.saved_bytes = 0
+        self.saved_seconds = 0.0
+
+    def get_hash(self, filename, key):
+        if filename not in self.hashes:
+            self.hashes[filename] = key.get('hash') or get_file_hash(filename)
+        return self.hashes[filename]
+
+    # Return the representative this file duplicates, registering the file as a new representative if there is none
+    def find(self, filename, key):
+        bucket = self.buckets.setdefault((key['size'], key['options']), [])
+        if bucket:
+            digest = self.get_hash(filename, key)
+            for representative, rep_key in bucket:
+                if self.get_hash(representative, rep_key) == digest:
+                    return representative
+        bucket.append((filename, key))
+        return None
+
+    def add_sibling(self, representative, filename, key):
+        self.siblings.setdefault(representative, []).append((filename, key))
+
+    # Mark a representative as finished and hand back the siblings that were waiting on it
+    def finish(self, representative, seconds):
+        self.finished[representative] = seconds
+        return self.siblings.pop(representative, [])
+
+    def count_saved(self, representative, key):
+        self.saved_files += 1
+        self.saved_bytes += key['size']
+        self.saved_seconds += self.finished.get(representative) or 0.0
+
+    def report(self):
+        print("Dedupe: {0} duplicate textures linked instead of converted, {1:.1f} MB and {2:.1f} maketx CPU-seconds saved.".format(
+            self.saved_files, self.saved_bytes / 1048576.0, self.saved_seconds))
+
+
+### ################# ###
+### DISTRIBUTED QUEUE ###
+### ################# ###
+
+# Serverless work queue on a shared filesystem, so a batch can be spread over any number of hosts.
+# The coordinator (txconvert PATH --queue DIR) writes one small JSON file per job into pending/.
+# Workers (txconvert --worker --queue DIR) claim a job by renaming it into claimed/ with their id appended.
+# The rename is atomic, so exactly one worker wins each job. While a job runs, its worker keeps touching
+# the claim file as a heartbeat. Claims whose heartbeat goes stale are renamed back into pending/ by any
+# other worker. Finished jobs move to done/ or failed/, and workers exit once the coordinator has closed
+# the queue and nothing is pending or claimed.
+
+QUEUE_STATES = ('pending', 'claimed', 'done', 'failed')
+QUEUE_SETTINGS = 'queue.json'
+QUEUE_CLOSED = 'closed'
+QUEUE_POLL = 2.0
+HEARTBEAT_INTERVAL = 10.0
+HEARTBEAT_STALE = 60.0
+QUEUE_SETTINGS_TIMEOUT = 120.0
+
+
+class WorkQueue(object):
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.worker_id = '{0}-{1}'.format(socket.gethostname(), os.getpid())
+        self.claims = set()
+        self._lock = threading.Lock()
+
+    def folder(self, state):
+        return os.path.join(self.path, state)
+
+    # Write a file under a temporary name first, so readers never see it half written
+    def write_json(self, path, data):
+        tmp_path = os.path.join(self.path, '.{0}.{1}.tmp'.format(os.path.basename(path), self.worker_id))
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    # Coordinator side: set up the folders and the settings every worker needs
+    def create(self, settings):
+        for state in QUEUE_STATES:
+            os.makedirs(self.folder(state), exist_ok=True)
+        if os.path.exists(os.path.join(self.path, QUEUE_CLOSED)):
+            os.remove(os.path.join(self.path, QUEUE_CLOSED))
+        self.write_json(os.path.join(self.path, QUEUE_SETTINGS), settings)
+
+    # Workers may start before the coordinator has set the queue up, so wait a while for the settings
+    def get_settings(self, timeout=QUEUE_SETTINGS_TIMEOUT):
+        settings_path = os.path.join(self.path, QUEUE_SETTINGS)
+        deadline = time.time() + timeout
+        if not os.path.exists(settings_path):
+            print('Waiting for the coordinator to write {0}'.format(settings_path))
+        while not os.path.exists(settings_path):
+            if time.time() > deadline:
+                raise RuntimeError('No {0} in {1} after {2:.0f}s, is this the queue directory the coordinator was given?'.format(
+                    QUEUE_SETTINGS, self.path, timeout))
+            time.sleep(QUEUE_POLL)
+        try:
+            with open(settings_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise RuntimeError('Could not read queue settings {0}: {1}'.format(settings_path, e))
+
+    # Job names sort largest source first, so workers pick up big textures before small ones
+    def put(self, filename, preset, key):
+        name = '{0:016d}-{1}.json'.format(max(0, 10 ** 15 - key['size']), hashlib.sha1(filename.encode()).hexdigest()[:16])
+        self.write_json(os.path.join(self.folder('pending'), name), {'source': filename, 'preset': preset, 'key': key})
+
+    def close(self):
+        open(os.path.join(self.path, QUEUE_CLOSED), 'w').close()
+
+    # Worker side: returns (claim name, job) or None when nothing is pending
+    def claim(self):
+        for name in sorted(os.listdir(self.folder('pending'))):
+            claim = '{0}@{1}'.format(name, self.worker_id)
+            path = os.path.join(self.folder('pending'), name)
+            try:
+                # Touch before the rename, the claim has to show up in claimed/ with a fresh heartbeat
+                os.utime(path)
+                os.rename(path, os.path.join(self.folder('claimed'), claim))
+            except OSError:
+                continue # Another worker got there first
+            with self._lock:
+                self.claims.add(claim)
+            with open(os.path.join(self.folder('claimed'), claim), 'r') as f:
+                return claim, json.load(f)
+        return None
+
+    def finish(self, claim, success):
+        with self._lock:
+            self.claims.discard(claim)
+        name = claim.rsplit('@', 1)[0]
+        try:
+            os.rename(os.path.join(self.folder('claimed'), claim), os.path.join(self.folder('done' if success else 'failed'), name))
+        except OSError:
+            pass # Claim went stale and was requeued meanwhile, the output is replaced atomically either way
+
+    def heartbeat(self):
+        with self._lock:
+            claims = list(self.claims)
+        for claim in claims:
+            try:
+                os.utime(os.path.join(self.folder('claimed'), claim))
+            except OSError:
+                with self._lock:
+                    self.claims.discard(claim)
+
+    # Put jobs from dead workers back into pending, returns how many were reclaimed
+    def reclaim_stale(self, stale=HEARTBEAT_STALE):
+        reclaimed = 0
+        now = time.time()
+        for claim in os.listdir(self.folder('claimed')):
+            path = os.path.join(self.folder('claimed'), claim)
+            try:
+                if now - os.path.getmtime(path) < stale:
+                    continue
+                os.rename(path, os.path.join(self.folder('pending'), claim.rsplit('@', 1)[0]))
+                reclaimed += 1
+                print("Reclaimed stale job {} ...".format(claim), flush=True)
+            except OSError:
+                continue
+        return reclaimed
+
+    def is_drained(self):
+        return (os.path.exists(os.path.join(self.path, QUEUE_CLOSED))
+                and not os.listdir(self.folder('pending')) and not os.listdir(self.folder('claimed')))
+
+
+# Pull jobs from a work queue with a pool of threads until the queue is drained
+def run_queue_worker(queue, convert, ocio, jobs):
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            queue.heartbeat()
+
+    def work():
+        while True:
+            claimed = queue.claim()
+            if not claimed:
+                queue.reclaim_stale()
+                if queue.is_drained():
+                    return
+                time.sleep(QUEUE_POLL)
+                continue
+            claim, job = claimed
+            try:
+                record, result = convert(job['source'], job['preset'], get_maketx_options(job['preset'], ocio), job['key'])
+            except Exception as e:
+                print("Failed to convert {0}: {1}".format(job['source'], e), flush=True)
+                queue.finish(claim, False)
+                continue
+            print(result, flush=True)
+            queue.finish(claim, record['action'] != 'failed')
+
+    heartbeat = threading.Thread(target=beat)
+    heartbeat.daemon = True
+    heartbeat.start()
+    try:
+        with futures.ThreadPoolExecutor(jobs) as executor:
+            for task in [executor.submit(work) for _ in range(jobs)]:
+                task.result()
+    finally:
+        stop.set()
+
+
+# Per-job telemetry: every conversion, link or failure is streamed to an optional JSONL/CSV report
+# while running totals, failures and the slowest jobs are kept for the end-of-batch summary.
+class BatchReport(object):
+    def __init__(self, path=None):
+        self.path = path
+        self.handle = None
+        self.writer = None
+        self.start = time.time()
+        self.files = 0
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.cpu_seconds = 0.0
+        self.failures = []
+        self.slowest = []
+        self._lock = threading.Lock()
+        if path:
+            self.handle = open(path, 'w', newline='')
+            if path.lower().endswith('.csv'):
+                self.writer = csv.DictWriter(self.handle, REPORT_FIELDS)
+                self.writer.writeheader()
+
+    def add(self, record):
+        with self._lock:
+            self.files += 1
+            self.input_bytes += record['input_bytes'] or 0
+            self.output_bytes += record['output_bytes'] or 0
+            self.cpu_seconds += record['cpu_seconds'] or 0.0
+            if record['action'] == 'failed':
+                self.failures.append(record)
+            # Min-heap of the slowest jobs so far
+            heapq.heappush(self.slowest, (record['wall_seconds'], self.files, record))
+            if len(self.slowest) > REPORT_SLOWEST:
+                heapq.heappop(self.slowest)
+            if self.writer:
+                self.writer.writerow(record)
+            elif self.handle:
+                self.handle.write(json.dumps(record) + '\n')
+            if self.handle:
+                self.handle.flush()
+
+    def close(self):
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+
+    def summary(self):
+        elapsed = max(time.time() - self.start, 1e-6)
+        print("\n####     BATCH SUMMARY     ####")
+        print("{0} jobs in {1:.1f}s: {2:.2f} files/s, {3:.1f} MB/s read, {4:.1f} MB written, {5:.1f} maketx CPU-seconds".format(
+            self.files, elapsed, self.files / elapsed, self.input_bytes / 1048576.0 / elapsed,
+            self.output_bytes / 1048576.0, self.cpu_seconds))
+        if self.slowest:
+            print("Slowest jobs:")
+            for wall_seconds, _, record in sorted(self.slowest, key=lambda item: item[0], reverse=True):
+                print("  {0:8.2f}s  {1:8.1f} MB  {2}".format(wall_seconds, (record['input_bytes'] or 0) / 1048576.0, record['source']))
+        if self.failures:
+            print("{0} failed jobs:".format(len(self.failures)))
+            for record in self.failures:
+                print("  {0} (exit code {1})".format(record['source'], record['exit_code']))
+                if record['log_tail']:
+                    print('    ' + record['log_tail'].replace('\n', '\n    '))
+        if self.path:
+            print("Report written to {}".format(self.path))
+
+
+# Walk the root path lazily with os.scandir, yielding (path, stat) for matching textures as they're found
+# Extension and substring filters are applied per entry and excluded directories are never entered,
+# so conversion can start on the first match instead of after the whole tree has been listed.
+def scan_textures(root, recursive, filter=None, exclude=(), progress=None):
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError as e:
+            print("Could not read {0}: {1}".format(current, e))
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and not any(fnmatch.fnmatch(entry.name, pattern) for pattern in exclude):
+                            stack.append(entry.path)
+                        continue
+                    if progress:
+                        progress.scanned += 1
+                    if not entry.name.endswith(VALID_FORMATS):
+                        continue
+                    if filter and (filter not in entry.path):
+                        continue
+                    yield entry.path, entry.stat()
+                except OSError:
+                    continue
+
+
+# Running counters for a batch, printed at most every PROGRESS_INTERVAL seconds
+class Progress(object):
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self.scanned = 0
+        self.found = 0
+        self.skipped = 0
+        self.queued = 0
+        self.done = 0
+        self.last = time.time()
+
+    def report(self, force=False):
+        now = time.time()
+        if not force and now - self.last < self.interval:
+            return
+        self.last = now
+        print("[progress] {0} files scanned, {1} textures found, {2} up to date, {3}/{4} converted".format(
+            self.scanned, self.found, self.skipped, self.done, self.queued), flush=True)
 
 
 # Main function to crawl for valid files/deal with flags, then call maketx
-def main(path, filter, recursive, verbose, *args):
+def main(path, filter, recursive, verbose, force=False, prune=False, use_hash=False, manifest_path=None,
+         jobs=None, threads_per_job=None, exclude=(), resume=False, journal_path=None, probe=False, dedupe=False,
+         profile_path=None, explain=False, report_path=None, queue_path=None, worker=False,
+         maketx_path=None, ocio_path=None, *args):
     # Initial path
     cwd = os.getcwd()
     if path != '.':
         cwd = os.path.abspath(path)
 
-    # Get all recursive files from target path
-    def get_files_recursive(start_path):
-        file_list = []
-        for root, dirs, files in os.walk(os.path.abspath(start_path)):
-            for file in files:
-                file_list.append(os.path.join(root, file))
-        return file_list
-
-    # Get all texture files
-    all_files = None
-    if recursive:
-        all_files = get_files_recursive(cwd)
+    # Workers take the root and manifest from the queue the coordinator set up
+    queue = WorkQueue(queue_path) if queue_path else None
+    if worker:
+        try:
+            settings = queue.get_settings()
+        except RuntimeError as e:
+            print(e)
+            sys.exit(1)
+        cwd, manifest_path, use_hash = settings['root'], settings['manifest'], settings['hash']
+        print('Working on queue {0} for root path {1} as {2}'.format(queue.path, cwd, queue.worker_id))
     else:
-        all_files = [os.path.join(cwd, file) for file in os.listdir(cwd)]
-    if not all_files:
-        print("No files in directory, exiting...")
-        sys.exit()
-
-    # Get all valid files based on file extensions
-    print('Processing textures in root path {0}. Recursive is {1}'.format(cwd, recursive))
-    texture_files = []
-    valid_formats = ('png', 'jpg', 'jpeg', 'tif', 'tiff', 'exr', 'dds', 'tga', 'bmp', 'psd')
-
-    for filename in all_files:
-        if filename.endswith(valid_formats):
-            if filter and (filter not in filename):
-                continue
-            else:
-                texture_files.append(os.path.abspath(filename))
+        print('Processing textures in root path {0}. Recursive is {1}'.format(cwd, recursive))
 
-    if not texture_files:
-        print("No valid texture files, exiting...")
-        sys.exit()
+    # Filename rules deciding each texture's maketx preset
+    classifier = TextureClassifier(load_profile(profile_path) if profile_path else None)
+    if explain:
+        for filename, st in scan_textures(cwd, recursive, filter, exclude):
+            print(classifier.explain(filename))
+        return
+
+    # Load the conversion manifest, files that already have a current output are skipped as they're found
+    manifest_path = manifest_path or os.path.join(cwd, MANIFEST_NAME)
+    manifest = ConversionManifest(manifest_path, use_hash).load()
+    if prune:
+        print("Pruned {0} stale manifest entries.".format(manifest.prune()))
+
+    # Journal for this batch, --resume picks up where a previous batch stopped
+    journal = BatchJournal(None if queue else journal_path or os.path.join(cwd, JOURNAL_NAME))
+    try:
+        requeued = journal.open(resume)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    if resume:
+        print("Resuming batch: {0} jobs finished, {1} unfinished jobs requeued.".format(len(journal.finished), requeued))
+
+    # maketx and the OCIO config are resolved and checked once, up front
+    try:
+        maketx = resolve_maketx(maketx_path) if worker or not queue else None # The coordinator never runs maketx
+        ocio = resolve_ocio(ocio_path)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    jobs, threads_per_job = get_worker_budget(jobs, threads_per_job)
+    progress = Progress()
+    duplicates = DedupeIndex() if dedupe else None
+    report = BatchReport(report_path)
+
+    # Job telemetry record, sizes are taken from disk once the job is over
+    def get_job_record(filename, output, action, start, details=None):
+        details = details or {}
+        record = {
+            'source': filename,
+            'output': output,
+            'action': action,
+            'exit_code': details.get('exit_code'),
+            'wall_seconds': round(time.time() - start, 4),
+            'cpu_seconds': details.get('cpu_seconds'),
+            'input_bytes': get_file_size(filename),
+            'output_bytes': get_file_size(output) if action != 'failed' else None,
+            'log_tail': details.get('log_tail', ''),
+        }
+        report.add(record)
+        return record
 
     # Run maketx function
-    print("Processing {0} texture files...".format(len(texture_files)))
-    with futures.ThreadPoolExecutor(len(texture_files)) as executor:
-        tasks = [executor.submit(run_maketx, file, verbose) for file in texture_files]
-        print("Starting maketx process...\n", flush=True)
-        for task in futures.as_completed(tasks):
-            print(task.result(), flush=True)
+    # Anything going wrong with one file (source removed mid-batch, output not writable) fails that file's job, not the batch
+    def convert(filename, preset, options, key):
+        start = time.time()
+        output = get_output_path(filename)
+        details = None
+        try:
+            temp_output = get_temp_output_path(output)
+            journal.write('start', filename, temp_output=temp_output)
+
+            # Files that are already in the target layout skip maketx, or at least the colorspace conversion
+            state = classify_image(probe_image(filename), preset) if probe else FULL_CONVERT
+            if state == COMPLIANT:
+                link_output(filename, output)
+                success, result, action = True, "Linked {} (already compliant) ...".format(filename), 'linked'
+            else:
+                run_options = options
+                if state == RETILE:
+                    # Only presets without a colorspace conversion are retiled, see classify_image
+                    run_options = get_maketx_options(preset, ocio, colorconvert=False)
+                success, result, details = run_maketx(maketx, filename, run_options, verbose, threads_per_job, temp_output)
+                action = 'retiled' if state == RETILE else 'converted'
+                if success and state == RETILE:
+                    result = "Retiled {} ...".format(filename)
+
+            if success:
+                manifest.record(filename, key, output)
+                journal.write('done', filename, **get_output_record(output))
+        except Exception as e:
+            success, result, details = False, "Failed to convert {0}: {1} ...".format(filename, e), {'log_tail': str(e)}
+
+        if not success:
+            journal.write('failed', filename)
+            action = 'failed'
+        return get_job_record(filename, output, action, start, details), result
+
+    # Give a duplicate the representative's output instead of converting it again
+    def link_duplicate(representative, filename, key):
+        start = time.time()
+        output = get_output_path(filename)
+        journal.write('start', filename)
+        progress.done += 1
+        try:
+            link_output(get_output_path(representative), output)
+            manifest.record(filename, key, output)
+            journal.write('done', filename, **get_output_record(output))
+        except Exception as e:
+            journal.write('failed', filename)
+            get_job_record(filename, output, 'failed', start, {'log_tail': str(e)})
+            print("Failed to link {0} (duplicate of {1}): {2} ...".format(filename, representative, e), flush=True)
+            return
+        duplicates.count_saved(representative, key)
+        get_job_record(filename, output, 'duplicate', start)
+        print("Linked {0} (duplicate of {1}) ...".format(filename, representative), flush=True)
+
+    def enqueue(filename, preset, options, key):
+        heapq.heappush(pending, (-key['size'], progress.queued, (filename, preset, options, key)))
+
+    # Jobs found while every maketx slot is busy wait in a bounded heap and go out largest first,
+    # so big textures don't end up as the batch's long tail
+    pending = []
+    running = set()
+
+    def collect(block):
+        nonlocal running
+        if not running:
+            return
+        done, running = futures.wait(running, timeout=None if block else 0, return_when=futures.FIRST_COMPLETED)
+        for task in done:
+            record, result = task.result()
+            filename = record['source']
+            success = record['action'] != 'failed'
+            seconds = record['cpu_seconds'] if record['cpu_seconds'] is not None else record['wall_seconds']
+            progress.done += 1
+            print(result, flush=True)
+            if duplicates:
+                # Siblings of a failed conversion go back in the queue to be converted on their own
+                for sibling, key in duplicates.finish(filename, seconds if success else None):
+                    if success:
+                        link_duplicate(filename, sibling, key)
+                    else:
+                        preset = classifier.get_preset(sibling)
+                        enqueue(sibling, preset, get_maketx_options(preset, ocio), key)
+
+    def submit_pending():
+        while pending and len(running) < jobs:
+            job = heapq.heappop(pending)[2]
+            running.add(executor.submit(convert, *job))
+
+    # Distributed worker: convert whatever the queue hands out
+    if worker:
+        print("Starting {0} maketx processes x {1} threads...\n".format(jobs, threads_per_job), flush=True)
+        try:
+            run_queue_worker(queue, convert, ocio, jobs)
+        finally:
+            manifest.save()
+            report.close()
+        if report.files:
+            report.summary()
+        if report.failures:
+            sys.exit(1)
+        return
+
+    # Distributed coordinator: fill the queue with everything that isn't up to date and leave it to the workers
+    if queue:
+        queue.create({'root': cwd, 'manifest': os.path.abspath(manifest_path), 'hash': use_hash})
+        try:
+            for filename, st in scan_textures(cwd, recursive, filter, exclude, progress):
+                progress.found += 1
+                preset = classifier.get_preset(filename)
+                key = manifest.get_key(filename, get_maketx_options(preset, ocio), st)
+                if not force and manifest.is_current(filename, key):
+                    progress.skipped += 1
+                else:
+                    progress.queued += 1
+                    queue.put(filename, preset, key)
+                progress.report()
+        finally:
+            queue.close()
+            manifest.save()
+        print("Queued {0} jobs in {1}, start workers with: txconvert --worker --queue {1}".format(progress.queued, queue.path))
+        return
+
+    print("Starting {0} maketx processes x {1} threads...\n".format(jobs, threads_per_job), flush=True)
+    try:
+        with futures.ThreadPoolExecutor(jobs) as executor:
+            for filename, st in scan_textures(cwd, recursive, filter, exclude, progress):
+                progress.found += 1
+                if journal.is_finished(filename):
+                    progress.skipped += 1
+                    continue
+                preset = classifier.get_preset(filename)
+                options = get_maketx_options(preset, ocio)
+                key = manifest.get_key(filename, options, st)
+                if not force and manifest.is_current(filename, key):
+                    progress.skipped += 1
+                    if duplicates and not duplicates.find(filename, key):
+                        duplicates.finish(filename, 0.0) # Up-to-date output can be linked to new copies
+                    progress.report()
+                    continue
+
+                progress.queued += 1
+                representative = duplicates.find(filename, key) if duplicates else None
+                if representative and duplicates.finished.get(representative) is not None:
+                    link_duplicate(representative, filename, key)
+                elif representative and representative not in duplicates.finished:
+                    duplicates.add_sibling(representative, filename, key)
+                else:
+                    enqueue(filename, preset, options, key)
+                    if len(pending) >= SCHEDULE_LOOKAHEAD:
+                        collect(block=True)
+                    collect(block=False)
+                    submit_pending()
+                progress.report()
+            while pending or running:
+                submit_pending()
+                collect(block=True)
+    finally:
+        manifest.save()
+        journal.close()
+        report.close()
+
+    progress.report(force=True)
+    if report.files:
+        report.summary()
+    if duplicates:
+        duplicates.report()
+    if not progress.found:
+        print("No valid texture files, exiting...")
+    elif not progress.queued:
+        print("All textures are up to date, exiting...")
+    if report.failures:
+        sys.exit(1)
 
 # Parse arguments and run main function
 if not __name__ == '__main__':
     sys.exit()
 
 parser = argparse.ArgumentParser(description='Arnold maketx batch utility.')
-parser.add_argument('path', help='Path for converting tx.')
+parser.add_argument('path', nargs='?', default='.', help='Path for converting tx.')
 parser.add_argument('-f', '--filter', action='store', type=str, help='Optional string filter to limit files to maketx')
 parser.add_argument('-r', '--recursive', action="store_true", help='Recursively look in subdirectories')
 parser.add_argument('-v', '--verbose', action="store_true", help='Show verbose output of maketx')
+parser.add_argument('--force', action="store_true", help='Convert every file even if the manifest says it is up to date')
+parser.add_argument('--prune', action="store_true", help='Remove manifest entries whose source or output no longer exists')
+parser.add_argument('--hash', action="store_true", help='Key the manifest on file contents as well, so touched but unchanged files are skipped')
+parser.add_argument('--manifest', action='store', type=str, help='Conversion manifest path (default: {} in the root path)'.format(MANIFEST_NAME))
+parser.add_argument('-j', '--jobs', action='store', type=int, help='Maximum number of concurrent maketx processes (default: derived from core count)')
+parser.add_argument('-t', '--threads-per-job', action='store', type=int, help='Threads given to each maketx process (default: derived from core count)')
+parser.add_argument('-x', '--exclude', action='append', default=[], help='Directory name or glob pattern to skip while crawling, can be repeated')
+parser.add_argument('--resume', action="store_true", help='Continue an interrupted batch from its journal, only requeueing unfinished or corrupt jobs')
+parser.add_argument('--journal', action='store', type=str, help='Batch journal path (default: {} in the root path)'.format(JOURNAL_NAME))
+parser.add_argument('-p', '--probe', action="store_true", help='Read EXR/TIFF headers and link already tiled/mipmapped files instead of reconverting them')
+parser.add_argument('-d', '--dedupe', action="store_true", help='Convert byte-identical textures once and link the result to every copy')
+parser.add_argument('--profile', action='store', type=str, help='JSON/YAML classification profile replacing the built-in filename rules')
+parser.add_argument('--explain', action="store_true", help='Print which rule and preset each file matches, without converting anything')
+parser.add_argument('--report', action='store', type=str, help='Write per-job timing, CPU and size telemetry to a .jsonl or .csv file')
+parser.add_argument('-q', '--queue', action='store', type=str, help='Shared work queue directory: fill it with jobs from path, or pull jobs from it with --worker')
+parser.add_argument('-w', '--worker', action="store_true", help='Run as a queue worker until the --queue directory is drained')
+parser.add_argument('--maketx', action='store', type=str, help='maketx binary (default: $MAKETX, then maketx on PATH)')
+parser.add_argument('--ocio', action='store', type=str, help='OCIO config file (default: $OCIO)')
 args = parser.parse_args()
+if args.worker and not args.queue:
+    parser.error('--worker needs a --queue directory')
 
-main(args.path, args.filter, args.recursive, args.verbose)
\ No newline at end of file
+main(args.path, args.filter, args.recursive, args.verbose, args.force, args.prune, args.hash, args.manifest,
+     args.jobs, args.threads_per_job, args.exclude, args.resume, args.journal, args.probe, args.dedupe,
+     args.profile, args.explain, args.report, args.queue, args.worker, args.maketx, args.ocio)
\ No newline at end of file